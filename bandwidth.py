@@ -0,0 +1,99 @@
+import time
+import logging
+import threading
+from datetime import datetime
+
+import config
+
+log = logging.getLogger(__name__)
+
+# Bandwidth cap of all downloads of the process: each read of a response body takes its
+# bytes from one token bucket, refilled at the current limit. The limit follows the
+# schedule, BANDWIDTH_LIMIT during PEAK_HOURS of PEAK_DAYS and BANDWIDTH_LIMIT_OFF_PEAK
+# otherwise, unless it is set from the GUI or the command line while downloading.
+# The number of downloads in flight is not limited by it: small files keep their
+# concurrency, the bytes of all downloads together stay under the limit.
+BURST_SECONDS = 0.5  # Bytes of this many seconds at the limit can be read at once after a pause
+SCHEDULE_INTERVAL = 60  # Seconds between two checks of the schedule
+MAX_SLEEP = 0.5  # The stop flag is checked at least this often while waiting
+
+
+def get_scheduled_limit(now=None) -> int:
+    """Bytes per second allowed by the schedule at now (local time), 0 when unlimited."""
+    now = now or datetime.now()
+    start, end = config.PEAK_HOURS
+    in_peak_hours = start <= now.hour < end if start <= end else (now.hour >= start or now.hour < end)
+    if in_peak_hours and now.weekday() in config.PEAK_DAYS:
+        return config.BANDWIDTH_LIMIT
+    return config.BANDWIDTH_LIMIT_OFF_PEAK
+
+
+def format_limit(limit) -> str:
+    return f"{limit / 1024 / 1024:.1f}MB/s" if limit else "unlimited"
+
+
+class TokenBucket:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.override = None  # Limit set live, None to follow the schedule
+        self.scheduled = 0
+        self.checked_at = 0.0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.waited = 0.0  # Seconds the reads waited for tokens
+
+    def get_limit(self) -> int:
+        """Bytes per second allowed now, 0 when unlimited."""
+        if self.override is not None:
+            return self.override
+        if time.monotonic() - self.checked_at >= SCHEDULE_INTERVAL:
+            with self.lock:
+                if time.monotonic() - self.checked_at >= SCHEDULE_INTERVAL:
+                    scheduled = get_scheduled_limit()
+                    if scheduled != self.scheduled:
+                        log.info(f"Bandwidth limit is now {format_limit(scheduled)}")
+                    self.scheduled = scheduled
+                    self.checked_at = time.monotonic()
+        return self.scheduled
+
+    def set_limit(self, limit):
+        """Set the limit in bytes per second (0 for none) until the end of the process, None to follow the schedule again."""
+        self.override = limit
+        self.checked_at = 0.0
+        log.info(f"Bandwidth limit set to {format_limit(self.get_limit())}{' (scheduled)' if limit is None else ''}")
+
+    def consume(self, count: int):
+        """Take count bytes from the bucket, waiting until the limit allows them."""
+        limit = self.get_limit()
+        if not limit:
+            return
+        with self.lock:
+            now = time.monotonic()
+            # A read takes its bytes at once, the next ones wait until the bucket is positive again
+            self.tokens = min(limit * BURST_SECONDS, self.tokens + (now - self.updated) * limit) - count
+            self.updated = now
+            wait = -self.tokens / limit
+        if wait <= 0:
+            return
+        with self.lock:
+            self.waited += wait
+        deadline = time.monotonic() + wait
+        while not config.stop_flag:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            time.sleep(min(left, MAX_SLEEP))
+
+    def refund(self, count: int):
+        """Give back bytes taken but not read."""
+        with self.lock:
+            self.tokens += count
+
+    def log_stats(self, rate):
+        limit = self.get_limit()
+        if limit or self.waited:
+            log.info(f"Bandwidth: {format_limit(rate)} for a limit of {format_limit(limit)}, reads waited {self.waited:.0f}s in total")
+
+
+limiter = TokenBucket()
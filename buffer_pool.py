@@ -0,0 +1,87 @@
+import logging
+import threading
+from collections import defaultdict
+
+import config
+
+log = logging.getLogger(__name__)
+
+# Download buffers: every transfer reads the response body into a bytearray taken
+# from this pool and writes it from there. Buffers are reused between transfers, and
+# their total size stays under DOWNLOAD_MEMORY_BUDGET whatever the number and the
+# size of the files in flight: transfers wait for a buffer when the budget is used.
+CHUNK_SECONDS = 0.25  # Read about this much data at the measured throughput
+WAIT_INTERVAL = 0.5  # The stop flag is checked at least this often while waiting for a buffer
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class BufferPool:
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.allocated = 0  # Bytes of all buffers, in use or free
+        self.in_use = 0
+        self.peak = 0
+        self.free = defaultdict(list)  # size: [bytearray]
+        self.condition = threading.Condition()
+
+    def acquire(self, size: int) -> bytearray:
+        """A buffer of size bytes, waiting while the budget is used. None when the stop flag is set meanwhile."""
+        size = min(size, self.budget)
+        with self.condition:
+            while self.in_use + size > self.budget:
+                if config.stop_flag:
+                    return None
+                self.condition.wait(WAIT_INTERVAL)
+            self.in_use += size
+            self.peak = max(self.peak, self.in_use)
+            if self.free[size]:
+                return self.free[size].pop()
+            # Free buffers of other sizes make room for the new one
+            for free_size, buffers in self.free.items():
+                while buffers and self.allocated + size > self.budget:
+                    buffers.pop()
+                    self.allocated -= free_size
+            self.allocated += size
+        return bytearray(size)
+
+    def release(self, buffer: bytearray):
+        with self.condition:
+            self.in_use -= len(buffer)
+            self.free[len(buffer)].append(buffer)
+            self.condition.notify_all()
+
+
+def get_pool() -> BufferPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = BufferPool(config.DOWNLOAD_MEMORY_BUDGET)
+    return _pool
+
+
+def get_buffer_size(length) -> int:
+    """Power of two buffer size for a body of length bytes (None when unknown), between the chunk size limits."""
+    size = config.MIN_CHUNK_SIZE
+    while size < config.MAX_CHUNK_SIZE and (length is None or size < length):
+        size *= 2
+    return size
+
+
+def next_chunk_size(read_bytes: int, seconds: float, buffer_size: int) -> int:
+    """Read size for about CHUNK_SECONDS of data at the throughput of the last read."""
+    if seconds <= 0:
+        return buffer_size
+    target = read_bytes / seconds * CHUNK_SECONDS
+    size = config.MIN_CHUNK_SIZE
+    while size * 2 <= min(target, buffer_size):
+        size *= 2
+    return size
+
+
+def log_stats():
+    if _pool is not None:
+        log.info(f"Download buffers: {_pool.allocated // 1024} KB allocated, {_pool.peak // 1024} KB in use at most")
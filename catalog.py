@@ -0,0 +1,403 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# On-disk catalog of the OneDrive items, one row per file or folder.
+# Enumeration writes to it as folders are listed, downloads and error replays
+# read it page by page, so memory use does not depend on the size of the drive
+# and the state survives a crash in the middle of a run.
+CATALOG_DB = "catalog.db"
+STATUS_ERROR = "error"
+STATUS_DEDUP = "dedup"  # Identical to a file downloaded in the same run, linked after it, see dedup.py
+PAGE_SIZE = 1000
+# Key added to items read from the catalog: time the download URL was obtained
+DOWNLOAD_URL_FETCHED = "@downloadUrlFetched"
+# Key added to items read from the catalog: local path of the file written for it, see relocation.py
+LOCAL_PATH = "@localPath"
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id TEXT PRIMARY KEY,
+    parent_id TEXT,
+    parent_path TEXT,
+    name TEXT,
+    is_folder INTEGER NOT NULL DEFAULT 0,
+    size INTEGER,
+    last_modified TEXT,
+    created TEXT,
+    hashes TEXT,
+    etag TEXT,
+    ctag TEXT,
+    download_url TEXT,
+    url_fetched REAL,
+    data TEXT NOT NULL,
+    generation INTEGER NOT NULL DEFAULT 0,
+    status TEXT,
+    local_path TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_items_path ON items(parent_path, name);
+CREATE INDEX IF NOT EXISTS idx_items_parent ON items(parent_id);
+CREATE INDEX IF NOT EXISTS idx_items_url ON items(download_url);
+CREATE INDEX IF NOT EXISTS idx_items_status ON items(status) WHERE status IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_items_size ON items(IFNULL(size, 0)) WHERE is_folder=0;
+CREATE TABLE IF NOT EXISTS local_hashes (
+    dev TEXT,
+    ino TEXT,
+    name TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    value TEXT,
+    PRIMARY KEY (dev, ino, name)
+);
+CREATE TABLE IF NOT EXISTS contents (
+    key TEXT PRIMARY KEY,
+    item_id TEXT,
+    path TEXT,
+    run INTEGER
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+UPSERT = """
+INSERT INTO items (id, parent_id, parent_path, name, is_folder, size, last_modified, created,
+                   hashes, etag, ctag, download_url, url_fetched, data, generation)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    parent_id=excluded.parent_id, parent_path=excluded.parent_path, name=excluded.name,
+    is_folder=excluded.is_folder, size=excluded.size, last_modified=excluded.last_modified,
+    created=excluded.created, hashes=excluded.hashes, etag=excluded.etag, ctag=excluded.ctag,
+    download_url=excluded.download_url, url_fetched=excluded.url_fetched, data=excluded.data,
+    generation=excluded.generation
+"""
+
+
+def get_connection():
+    """One connection per thread, the database is shared through WAL mode."""
+    global _schema_ready
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CATALOG_DB, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _schema_lock:
+            if not _schema_ready:
+                conn.executescript(SCHEMA)
+                migrate(conn)
+                _schema_ready = True
+        _local.conn = conn
+    return conn
+
+
+def migrate(conn):
+    """Add the columns missing from catalogs created by previous versions."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(items)")}
+    if "url_fetched" not in columns:
+        with conn:
+            conn.execute("ALTER TABLE items ADD COLUMN url_fetched REAL")
+    if "local_path" not in columns:
+        with conn:
+            conn.execute("ALTER TABLE items ADD COLUMN local_path TEXT")
+    with conn:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_items_local_path ON items(local_path) WHERE local_path IS NOT NULL")
+
+
+def transaction():
+    """Use as `with catalog.transaction():`, commits on success and rolls back on error."""
+    return get_connection()
+
+
+def item_to_row(item, generation):
+    parent = item.get("parentReference", {})
+    download_url = item.get("@microsoft.graph.downloadUrl")
+    return (
+        item["id"],
+        parent.get("id"),
+        parent.get("path"),
+        item.get("name"),
+        1 if "folder" in item else 0,
+        item.get("size"),
+        item.get("lastModifiedDateTime"),
+        item.get("createdDateTime"),
+        json.dumps(item["file"]["hashes"]) if "hashes" in item.get("file", {}) else None,
+        item.get("eTag"),
+        item.get("cTag"),
+        download_url,
+        item.get(DOWNLOAD_URL_FETCHED, time.time()) if download_url else None,
+        json.dumps(item, ensure_ascii=False),
+        generation,
+    )
+
+
+def row_to_item(data, parent_path, download_url, url_fetched, local_path=None):
+    """Rebuild the Graph item, path and download URL columns are kept up to date over the stored JSON."""
+    item = json.loads(data)
+    item.setdefault("parentReference", {})["path"] = parent_path
+    if download_url:
+        item["@microsoft.graph.downloadUrl"] = download_url
+        item[DOWNLOAD_URL_FETCHED] = url_fetched
+    if local_path:
+        item[LOCAL_PATH] = local_path
+    return item
+
+
+def get_state(key):
+    row = get_connection().execute("SELECT value FROM state WHERE key=?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_state(key, value):
+    """Must be called inside a transaction."""
+    if value is None:
+        get_connection().execute("DELETE FROM state WHERE key=?", (key,))
+    else:
+        get_connection().execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+
+
+def upsert_items(items, generation=None):
+    """Must be called inside a transaction."""
+    if generation is None:
+        generation = int(get_state("generation") or 0)
+    rows = [item_to_row(item, generation) for item in items]
+    get_connection().executemany(UPSERT, rows)
+    return len(rows)
+
+
+def delete_items(ids):
+    """Must be called inside a transaction."""
+    get_connection().executemany("DELETE FROM items WHERE id=?", ((one_id,) for one_id in ids))
+
+
+def load_folders() -> dict:
+    """Return {id: (parent_id, name)} for every folder."""
+    rows = get_connection().execute("SELECT id, parent_id, name FROM items WHERE is_folder=1")
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
+def set_parent_paths(parent_paths):
+    """Set the parent path of the children of each (parent_id, path). Must be called inside a transaction."""
+    get_connection().executemany(
+        "UPDATE items SET parent_path=? WHERE parent_id=? AND parent_path IS NOT ?",
+        ((path, parent_id, path) for parent_id, path in parent_paths),
+    )
+
+
+def delete_orphans(scope_id):
+    """Remove items whose parent folder is not in the catalog. Must be called inside a transaction."""
+    cursor = get_connection().execute(
+        "DELETE FROM items WHERE parent_id IS NOT ? AND parent_id NOT IN (SELECT id FROM items WHERE is_folder=1)",
+        (scope_id,),
+    )
+    return cursor.rowcount
+
+
+class Scan:
+    """A full listing of the tree.
+
+    Items are saved as they are found, items of the previous listings that were not
+    seen again are removed when the scan completes. An interrupted scan keeps them.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.folders = 0
+        self.failed_folders = 0  # Listings that gave up, the scan must not complete
+        with transaction():
+            self.generation = int(get_state("generation") or 0) + 1
+            set_state("generation", str(self.generation))
+
+    def extend(self, items):
+        items = list(items)
+        if not items:
+            return
+        with transaction():
+            upsert_items(items, self.generation)
+        nb_folders = sum(1 for item in items if "folder" in item)
+        self.folders += nb_folders
+        self.files += len(items) - nb_folders
+
+    def complete(self, root, delta_link=None):
+        with transaction():
+            removed = get_connection().execute("DELETE FROM items WHERE generation < ?", (self.generation,)).rowcount
+            set_state("root", root)
+            set_state("deltaLink", delta_link)
+        log.info(f"Scan complete, {removed} items not found anymore removed from catalog")
+
+
+def count_files(status=None) -> int:
+    if status:
+        row = get_connection().execute("SELECT COUNT(*) FROM items WHERE is_folder=0 AND status=?", (status,)).fetchone()
+    else:
+        row = get_connection().execute("SELECT COUNT(*) FROM items WHERE is_folder=0").fetchone()
+    return row[0]
+
+
+def count_folders() -> int:
+    return get_connection().execute("SELECT COUNT(*) FROM items WHERE is_folder=1").fetchone()[0]
+
+
+def get_file_conditions(status=None, min_size=None, max_size=None):
+    """WHERE clause and parameters for the files with a status and a size in [min_size, max_size[."""
+    conditions, params = ["is_folder=0"], []
+    if status:
+        conditions.append("status=?")
+        params.append(status)
+    if min_size is not None:
+        conditions.append("IFNULL(size, 0)>=?")
+        params.append(min_size)
+    if max_size is not None:
+        conditions.append("IFNULL(size, 0)<?")
+        params.append(max_size)
+    return " AND ".join(conditions), params
+
+
+def iter_files(status=None, min_size=None, max_size=None):
+    """Yield file items page by page, without keeping a read transaction open between pages."""
+    where, params = get_file_conditions(status, min_size, max_size)
+    last_rowid = 0
+    conn = get_connection()
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, data, parent_path, download_url, url_fetched, local_path FROM items"
+            f" WHERE {where} AND rowid>? ORDER BY rowid LIMIT ?",
+            (*params, last_rowid, PAGE_SIZE),
+        ).fetchall()
+        if not rows:
+            return
+        for rowid, *columns in rows:
+            yield row_to_item(*columns)
+        last_rowid = rows[-1][0]
+
+
+def iter_files_by_size(status=None, min_size=None, max_size=None):
+    """Yield file items largest first, page by page like iter_files."""
+    where, params = get_file_conditions(status, min_size, max_size)
+    last = None
+    conn = get_connection()
+    while True:
+        if last is None:
+            after, after_params = "", ()
+        else:
+            after, after_params = " AND (IFNULL(size, 0)<? OR (IFNULL(size, 0)=? AND rowid>?))", (last[0], last[0], last[1])
+        rows = conn.execute(
+            "SELECT IFNULL(size, 0), rowid, data, parent_path, download_url, url_fetched, local_path FROM items"
+            f" WHERE {where}{after} ORDER BY IFNULL(size, 0) DESC, rowid LIMIT ?",
+            (*params, *after_params, PAGE_SIZE),
+        ).fetchall()
+        if not rows:
+            return
+        for size, rowid, *columns in rows:
+            yield row_to_item(*columns)
+        last = rows[-1][:2]
+
+
+def sum_file_sizes(status=None, min_size=None, max_size=None) -> int:
+    where, params = get_file_conditions(status, min_size, max_size)
+    return get_connection().execute(f"SELECT IFNULL(SUM(size), 0) FROM items WHERE {where}", params).fetchone()[0]
+
+
+def find_item_by_url(url):
+    row = get_connection().execute(
+        "SELECT data, parent_path, download_url, url_fetched, local_path FROM items WHERE download_url=? LIMIT 1", (url,)
+    ).fetchone()
+    return row_to_item(*row) if row else None
+
+
+def find_item_by_id(item_id):
+    row = get_connection().execute(
+        "SELECT data, parent_path, download_url, url_fetched, local_path FROM items WHERE id=?", (item_id,)
+    ).fetchone()
+    return row_to_item(*row) if row else None
+
+
+def set_download_urls(urls):
+    """Save refreshed download URLs, urls is a list of (url, item_id)."""
+    now = time.time()
+    with transaction():
+        get_connection().executemany(
+            "UPDATE items SET download_url=?, url_fetched=? WHERE id=?", ((url, now, item_id) for url, item_id in urls)
+        )
+
+
+def set_status(item_id, status):
+    with transaction():
+        get_connection().execute("UPDATE items SET status=? WHERE id=?", (status, item_id))
+
+
+def clear_status(status):
+    with transaction():
+        get_connection().execute("UPDATE items SET status=NULL WHERE status=?", (status,))
+
+
+def get_local_hash(stat_key, name):
+    """Cached hash of a local file, None when its stat changed since it was hashed. See file_hashes.py."""
+    dev, ino, size, mtime_ns = stat_key
+    row = get_connection().execute(
+        "SELECT value FROM local_hashes WHERE dev=? AND ino=? AND name=? AND size=? AND mtime_ns=?",
+        (dev, ino, name, size, mtime_ns),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def set_local_hash(stat_key, name, value):
+    dev, ino, size, mtime_ns = stat_key
+    with transaction():
+        get_connection().execute(
+            "INSERT OR REPLACE INTO local_hashes (dev, ino, name, size, mtime_ns, value) VALUES (?, ?, ?, ?, ?, ?)",
+            (dev, ino, name, size, mtime_ns, value),
+        )
+
+
+def get_content(key):
+    """(item id, local path, run) of the file written for a content, None when there is none. See dedup.py."""
+    return get_connection().execute("SELECT item_id, path, run FROM contents WHERE key=?", (key,)).fetchone()
+
+
+def claim_content(key, item_id, path, run):
+    with transaction():
+        get_connection().execute(
+            "INSERT OR REPLACE INTO contents (key, item_id, path, run) VALUES (?, ?, ?, ?)", (key, item_id, path, run)
+        )
+
+
+def add_content(key, item_id, path):
+    """Record a file for a content that has none, as written by a previous run."""
+    with transaction():
+        get_connection().execute(
+            "INSERT OR IGNORE INTO contents (key, item_id, path, run) VALUES (?, ?, ?, 0)", (key, item_id, path)
+        )
+
+
+def release_content(key, item_id):
+    with transaction():
+        get_connection().execute("DELETE FROM contents WHERE key=? AND item_id=?", (key, item_id))
+
+
+def set_local_path(item_id, path):
+    """Record the local path (relative to the backup folder) of the file written for an item."""
+    with transaction():
+        get_connection().execute("UPDATE items SET local_path=? WHERE id=?", (path, item_id))
+
+
+def is_local_path_used(path, item_id) -> bool:
+    """True when another item has its file at the local path."""
+    row = get_connection().execute(
+        "SELECT 1 FROM items WHERE local_path=? AND id<>? LIMIT 1", (path, item_id)
+    ).fetchone()
+    return row is not None
+
+
+def move_content_path(source, target):
+    """Follow a file moved on disk in the contents it is the source of, see dedup.py."""
+    with transaction():
+        get_connection().execute("UPDATE contents SET path=? WHERE path=?", (target, source))
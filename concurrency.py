@@ -0,0 +1,164 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+import config
+
+log = logging.getLogger(__name__)
+
+# AIMD concurrency control, as in TCP congestion control: the number of requests in
+# flight grows by one per round of successful requests while latency and error rate
+# stay healthy, and is halved when Graph throttles (429, 503). New requests are held
+# back for the Retry-After delay given by the service.
+LATENCY_FACTOR = 2.0  # No growth while the latency is above this multiple of the best latency seen
+MAX_ERROR_RATE = 0.05  # No growth while the error rate is above this
+SMOOTHING = 0.1  # Weight of a new sample in the latency and error rate moving averages
+DECREASE_FACTOR = 0.5
+POLL_INTERVAL = 1.0
+
+
+class AdaptiveConcurrency:
+    """Limit of requests in flight, adjusted from the outcome of each request.
+
+    Use `with limiter.slot():` (threads) or `async with limiter.slot_async():` (tasks of one
+    event loop) around a request, and report its outcome with record() before leaving the slot.
+    """
+
+    def __init__(self, name: str, initial: int, maximum: int, minimum: int = 1):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.latency = None
+        self.best_latency = None
+        self.error_rate = 0.0
+        self.decreased_at = 0.0
+        self.throttled = 0
+        self.peak = self.current
+        self.condition = threading.Condition()
+        self.async_waiters = deque()
+
+    @property
+    def current(self) -> int:
+        return int(self.limit)
+
+    def _wait_time(self):
+        """None when a request can start now, else the time to wait before checking again."""
+        now = time.monotonic()
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.in_flight < self.current:
+            return None
+        return POLL_INTERVAL
+
+    def acquire(self):
+        with self.condition:
+            while not config.stop_flag:
+                wait = self._wait_time()
+                if wait is None:
+                    break
+                self.condition.wait(wait)
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        while True:
+            with self.condition:
+                wait = self._wait_time()
+                if wait is None or config.stop_flag:
+                    self.in_flight += 1
+                    return
+                waiter = asyncio.get_running_loop().create_future()
+                self.async_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self._wake(1)
+
+    def _wake(self, count):
+        """Wake up to count waiting threads and tasks, must be called with the condition held."""
+        self.condition.notify(count)
+        while count > 0 and self.async_waiters:
+            waiter = self.async_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                count -= 1
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self):
+        await self.acquire_async()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def record(self, status, latency=None, retry_after=None):
+        """Report the outcome of a request: HTTP status (None for a network error) and seconds to the response."""
+        if status in (429, 503):
+            self.on_throttle(retry_after)
+        elif status is None or status >= 500:
+            self.on_error()
+        else:
+            self.on_success(latency)
+
+    def on_success(self, latency=None):
+        with self.condition:
+            self.error_rate *= 1 - SMOOTHING
+            if latency is not None:
+                self.latency = latency if self.latency is None else self.latency + SMOOTHING * (latency - self.latency)
+                if self.best_latency is None or self.latency < self.best_latency:
+                    self.best_latency = self.latency
+            healthy = (self.latency is None or self.latency <= LATENCY_FACTOR * self.best_latency) and self.error_rate < MAX_ERROR_RATE
+            # Only grow when the limit is reached, not when there is not enough work to use it
+            if healthy and self.in_flight >= self.current and self.limit < self.maximum:
+                previous = self.current
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                if self.current > previous:
+                    self.peak = max(self.peak, self.current)
+                    log.debug(f"{self.name}: concurrency {previous} -> {self.current}")
+                    self._wake(self.current - previous)
+
+    def on_error(self):
+        with self.condition:
+            self.error_rate += SMOOTHING * (1 - self.error_rate)
+
+    def on_throttle(self, retry_after=None):
+        with self.condition:
+            self.error_rate += SMOOTHING * (1 - self.error_rate)
+            self.throttled += 1
+            now = time.monotonic()
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            # Requests sent before the last decrease report their throttling afterwards, one decrease per round
+            if now - self.decreased_at > max(self.latency or 0, POLL_INTERVAL):
+                previous = self.current
+                self.limit = max(self.minimum, self.limit * DECREASE_FACTOR)
+                self.decreased_at = now
+                log.warning(f"{self.name}: throttled, concurrency {previous} -> {self.current}, waiting {retry_after or 0}s")
+
+    def log_summary(self):
+        log.info(f"{self.name}: concurrency {self.current} at the end, {self.peak} at most, throttled {self.throttled} times")
+
+
+def create(name: str, initial: int, maximum: int) -> AdaptiveConcurrency:
+    """Limiter from the configuration, the limit stays at initial when ADAPTIVE_CONCURRENCY is off."""
+    if not config.ADAPTIVE_CONCURRENCY:
+        maximum = initial
+    return AdaptiveConcurrency(name, initial, maximum)
@@ -7,32 +7,67 @@ import utils
 # https://learn.microsoft.com/en-us/onedrive/developer/rest-api/?view=odsp-graph-online
 
 def initialize(): 
-    global OFFLINEBACKUP_PATH, ONEDRIVEDIR_PATH, MAX_RETRIES,MAX_WORKERS,MAX_WORKERS_GEN,INSTALL_DIR,BG_IMG,iscommandline,downloadinprogress,isprocessing,excluded_endpoints,item_download_errors,stop_flag,num_error,MAX_ERRORS,status_str,progress_num,exclusion_list,progress_tot,MIN_FREE_SPACE_BYTES,LOG_FILE,LOG_LEVEL,LOG_BACKUP_COUNT,TIMEOUT,folder_queue,accesstoken,file_list
+    global OFFLINEBACKUP_PATH, ONEDRIVEDIR_PATH, MAX_RETRIES,RETRY_BUDGETS,RETRY_BASE_DELAY,RETRY_MAX_DELAY,MAX_WORKERS,MAX_WORKERS_GEN,INSTALL_DIR,BG_IMG,iscommandline,isprocessing,excluded_endpoints,stop_flag,num_error,MAX_ERRORS,status_str,progress_num,exclusion_list,progress_tot,MIN_FREE_SPACE_BYTES,LOG_FILE,LOG_LEVEL,LOG_BACKUP_COUNT,TIMEOUT,folder_queue,accesstoken,USE_DELTA,USE_BATCH_LISTING,LISTING_PAGE_SIZE,HTTP_POOL_SIZE,ADAPTIVE_CONCURRENCY,MAX_WORKERS_LIMIT,MAX_WORKERS_GEN_LIMIT,ENUM_ENGINE,ASYNC_LISTING_CONCURRENCY,DOWNLOAD_URL_TTL,DOWNLOAD_URL_MARGIN,RESUME_MIN_SIZE,RESUME_CHECKPOINT,SEGMENTED_MIN_SIZE,SEGMENT_COUNT,DOWNLOAD_MEMORY_BUDGET,MIN_CHUNK_SIZE,MAX_CHUNK_SIZE,LARGE_FILE_MIN_SIZE,MAX_WORKERS_LARGE,MAX_WORKERS_LARGE_LIMIT,HASH_CHECK,LOCAL_INDEX,LOCAL_SCAN_WORKERS,SPACE_SAMPLE_INTERVAL,FSYNC_POLICY,FSYNC_BATCH_FILES,FSYNC_BATCH_SECONDS,PREALLOCATE,BANDWIDTH_LIMIT,BANDWIDTH_LIMIT_OFF_PEAK,PEAK_HOURS,PEAK_DAYS,DEDUP_MODE,RELOCATE_MOVED
     INSTALL_DIR=utils.get_main_dir()
     OFFLINEBACKUP_PATH = os.path.join(INSTALL_DIR, "Downloads")
     ONEDRIVEDIR_PATH = "/"
     MAX_RETRIES = 3
+    # Retries per request for each failure class, see retry_policy.py
+    RETRY_BUDGETS = {"transient": 5, "throttled": 10, "auth_expired": 2, "not_found": 1, "permanent": 0}
+    RETRY_BASE_DELAY = 1  # Seconds, doubled at each retry of the same class, with jitter
+    RETRY_MAX_DELAY = 60
     MAX_WORKERS = 10
     MAX_WORKERS_GEN = 20
+    ADAPTIVE_CONCURRENCY = True  # Grow the workers above while Graph keeps up, shrink them when it throttles
+    MAX_WORKERS_LIMIT = 32  # Most download workers with adaptive concurrency
+    MAX_WORKERS_GEN_LIMIT = 64  # Most listing workers with adaptive concurrency
+    LARGE_FILE_MIN_SIZE = 100 * 1024 * 1024  # Files from this size are downloaded in their own lane, largest first
+    MAX_WORKERS_LARGE = 4  # Download workers of the large files lane, MAX_WORKERS is for the small files lane
+    MAX_WORKERS_LARGE_LIMIT = 8
+    HTTP_POOL_SIZE = max(MAX_WORKERS_LIMIT + MAX_WORKERS_LARGE_LIMIT, MAX_WORKERS_GEN_LIMIT)  # Kept-alive connections per host, shared by all workers
     LOG_LEVEL=logging.INFO
     stop_flag=False
     isprocessing=False
     iscommandline=False
     num_error=0
     exclusion_list=[]
-    downloadinprogress=[]
-    item_download_errors=[]
     MAX_ERRORS=max(MAX_WORKERS, MAX_WORKERS_GEN)+5
     #MAX_ERRORS=3
     status_str=""
     progress_num=0
     progress_tot=10000
     MIN_FREE_SPACE_BYTES = 5 * 1024 * 1024 * 1024  # 1GB
+    SPACE_SAMPLE_INTERVAL = 10  # Seconds between two reads of the free space, downloads in flight reserve their size meanwhile
     LOG_FILE = os.path.join(INSTALL_DIR,"logs", "OneDriveOfflineBackup.log")
     BG_IMG = os.path.join(INSTALL_DIR,"imgs","OneDriveOfflineBackup.png")
     LOG_BACKUP_COUNT = 10  # Keep up to 10 backup logs
     TIMEOUT = 10
     accesstoken=""
-    file_list=[]
     folder_queue = Queue()
-
+    USE_DELTA = True  # Incremental listing through /delta when a delta token is available
+    USE_BATCH_LISTING = True  # List up to 20 folders per Graph $batch request during full scans
+    LISTING_PAGE_SIZE = 999  # Items per folder listing page ($top)
+    ENUM_ENGINE = "async"  # Full scan engine: "async" (asyncio, needs aiohttp) or "thread"
+    ASYNC_LISTING_CONCURRENCY = 64  # Most folder listing requests in flight with the async engine
+    DOWNLOAD_URL_TTL = 3600  # Pre-authenticated download urls are short lived, about 1 hour
+    DOWNLOAD_URL_MARGIN = 600  # Refresh download urls this many seconds before they expire
+    RESUME_MIN_SIZE = 100 * 1024 * 1024  # Files from this size save their progress next to their .part file, resumed after a failure
+    RESUME_CHECKPOINT = 64 * 1024 * 1024  # Bytes written between two saves of the resume offset
+    SEGMENTED_MIN_SIZE = 1024 * 1024 * 1024  # Files from this size are downloaded in parallel segments
+    SEGMENT_COUNT = 4  # Connections per segmented download, 1 to disable
+    PREALLOCATE = True  # Allocate .part files to their full size first, turn off on network shares that emulate it by writing the file
+    DOWNLOAD_MEMORY_BUDGET = 256 * 1024 * 1024  # Bytes of download buffers for all transfers in flight
+    MIN_CHUNK_SIZE = 64 * 1024  # Read size of a transfer adapts to its throughput between these
+    MAX_CHUNK_SIZE = 8 * 1024 * 1024
+    BANDWIDTH_LIMIT = 0  # Bytes per second of all downloads during peak hours, 0 for no limit
+    BANDWIDTH_LIMIT_OFF_PEAK = 0  # Bytes per second outside peak hours, 0 for no limit
+    PEAK_HOURS = (8, 18)  # Local hours from start to end (excluded) of the peak hours
+    PEAK_DAYS = (0, 1, 2, 3, 4)  # Days with peak hours, Monday is 0
+    HASH_CHECK = False  # Compare local files to OneDrive by content hash instead of size and date, local hashes are cached
+    DEDUP_MODE = "off"  # Identical files downloaded once, the copies linked to it: "off", "auto" (reflink or hard link), "hardlink" or "reflink"
+    RELOCATE_MOVED = True  # Files moved or renamed on OneDrive are moved locally instead of downloaded again
+    FSYNC_POLICY = "none"  # Sync downloads to disk before renaming them into place: "none", "file" or "batch" (slower, survives power loss)
+    FSYNC_BATCH_FILES = 100  # With "batch", complete files are synced and renamed together every so many files
+    FSYNC_BATCH_SECONDS = 5  # or every so many seconds
+    LOCAL_INDEX = True  # List the backup folder once per run instead of checking each file and folder on disk
+    LOCAL_SCAN_WORKERS = 16  # Directories listed in parallel
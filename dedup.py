@@ -0,0 +1,159 @@
+import os
+import time
+import errno
+import logging
+import threading
+
+import config
+import catalog
+import file_hashes
+
+log = logging.getLogger(__name__)
+
+# Identical files of the drive are downloaded once. The catalog keeps, for each content
+# (size and OneDrive hash), the local file written for it. Another item with the same
+# content is then made a reflink (copy on write, where the file system supports it) or a
+# hard link of that file instead of being downloaded, once the file is checked to still
+# have that content. Downloads never write into an existing file, they are renamed over
+# it: an item edited on OneDrive gets a file of its own, the other links keep the old one.
+DEDUP_OFF = "off"
+DEDUP_AUTO = "auto"  # Reflink where supported, hard link otherwise
+DEDUP_HARDLINK = "hardlink"
+DEDUP_REFLINK = "reflink"  # Items are downloaded where reflinks are not supported
+FICLONE = 0x40049409  # Linux ioctl cloning a file, Btrfs and XFS
+
+# What to do with an item, see Deduplicator.prepare
+DOWNLOAD = "download"
+HARDLINKED = "hardlinked"  # Shares the file and its dates with the other copies
+CLONED = "cloned"  # Reflink, a file of its own with its own dates
+DEFERRED = "deferred"
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def get_content_key(item):
+    """Key of the content of the item, None when OneDrive gave no hash."""
+    remote = file_hashes.get_remote_hash(item)
+    if remote is None or not item.get("size"):
+        return None
+    name, value = remote
+    return f"{item['size']}:{name}:{value}"
+
+
+def reflink(source, target):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this system")
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(target)
+            raise
+
+
+class Deduplicator:
+
+    def __init__(self, mode=None):
+        self.mode = mode or config.DEDUP_MODE
+        self.run = time.time_ns()  # Claims of this run
+        self.lock = threading.Lock()
+        self.reflinks = self.mode in (DEDUP_AUTO, DEDUP_REFLINK)
+        self.linked = 0
+        self.bytes_saved = 0
+        self.requests_saved = 0
+        self.deferred = 0
+
+    def prepare(self, item, local_file_path, defer=True) -> str:
+        """Link the item to a local file with its content (HARDLINKED or CLONED), or claim its content and return DOWNLOAD.
+
+        An item whose content is claimed by a download of this run is DEFERRED when defer is
+        True, to be linked once that download is done, and is linked to it otherwise.
+        """
+        key = get_content_key(item)
+        if key is None:
+            return DOWNLOAD
+        with self.lock:
+            claim = catalog.get_content(key)
+            if claim is None or claim[0] == item["id"]:
+                # First copy, or its own file changed locally
+                catalog.claim_content(key, item["id"], local_file_path, self.run)
+                return DOWNLOAD
+            if claim[2] == self.run and defer:
+                self.deferred += 1
+                return DEFERRED
+        # Checked out of the lock, a file not hashed yet is read in full
+        if not self.has_content(item, claim[1]):
+            with self.lock:
+                catalog.claim_content(key, item["id"], local_file_path, self.run)
+            return DOWNLOAD
+        outcome = self.link(claim[1], local_file_path)
+        if outcome is None:
+            return DOWNLOAD
+        with self.lock:
+            self.linked += 1
+            self.bytes_saved += item["size"]
+            segmented = item["size"] >= config.SEGMENTED_MIN_SIZE and config.SEGMENT_COUNT > 1
+            self.requests_saved += config.SEGMENT_COUNT if segmented else 1
+        return outcome
+
+    def has_content(self, item, path) -> bool:
+        """True when the file at path still has the content of the item, its hash is cached."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return stat.st_size == item["size"] and bool(file_hashes.is_same_content(item, path, stat))
+
+    def link(self, source, local_file_path):
+        """Make local_file_path a reflink or a hard link of source, replacing the file there. None when it failed."""
+        temp_path = local_file_path + ".link"
+        try:
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+            outcome = self.make_link(source, temp_path)
+            if outcome is not None:
+                os.replace(temp_path, local_file_path)
+            return outcome
+        except OSError as e:
+            log.warning(f"Cannot link {local_file_path.encode('utf-8')} to {source.encode('utf-8')}: {e}")
+            return None
+
+    def make_link(self, source, target):
+        if self.reflinks:
+            try:
+                reflink(source, target)
+                return CLONED
+            except OSError as e:
+                if self.mode == DEDUP_REFLINK:
+                    log.debug(f"No reflink of {source.encode('utf-8')}: {e}")
+                    return None
+                # Not supported by this file system, hard links from now on
+                log.info(f"Reflinks not supported ({e}), identical files are hard linked")
+                self.reflinks = False
+        try:
+            os.link(source, target)
+        except OSError as e:
+            # Other device, link count limit, or not supported: downloaded instead
+            log.debug(f"No hard link of {source.encode('utf-8')}: {e}")
+            return None
+        return HARDLINKED
+
+    def release(self, item):
+        """End the claim of a failed download, the next item with its content is downloaded."""
+        key = get_content_key(item)
+        if key is not None:
+            catalog.release_content(key, item["id"])
+
+    def add_source(self, item, local_file_path):
+        """Offer an unchanged file for the items with its content, when no file is known for it."""
+        key = get_content_key(item)
+        if key is not None:
+            catalog.add_content(key, item["id"], local_file_path)
+
+    def log_stats(self):
+        log.info(f"Identical files: {self.linked} linked instead of downloaded, {self.bytes_saved // (1024 * 1024)} MB "
+                 f"and {self.requests_saved} requests saved, {self.deferred} deferred until their first copy was downloaded")
@@ -0,0 +1,72 @@
+import os
+import time
+import shutil
+import logging
+import threading
+
+import config
+
+log = logging.getLogger(__name__)
+
+# Free space accounting of the backup folder: the size of each item is reserved when
+# it is found to need a download and released when the download ends. Unchanged,
+# moved and linked files take no space. Free space is sampled every
+# SPACE_SAMPLE_INTERVAL seconds, bytes written since the last sample are deducted
+# from it, and the space reserved by downloads in flight is not available.
+
+
+class SpaceAccountant:
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.reserved = {}  # item id: bytes
+        self.reserved_bytes = 0
+        self.free = 0
+        self.sampled_at = 0.0
+        self.samples = 0
+
+    def sample(self):
+        """Read the free space, must be called with the lock held."""
+        path = os.path.abspath(self.folder)
+        while not os.path.isdir(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)  # The backup folder is created by the first download
+        self.free = shutil.disk_usage(path).free
+        self.sampled_at = time.monotonic()
+        self.samples += 1
+
+    def get_available(self) -> int:
+        """Bytes that can still be reserved above MIN_FREE_SPACE_BYTES."""
+        with self.lock:
+            return self.available()
+
+    def available(self) -> int:
+        """get_available, must be called with the lock held."""
+        if time.monotonic() - self.sampled_at >= config.SPACE_SAMPLE_INTERVAL:
+            self.sample()
+        return self.free - config.MIN_FREE_SPACE_BYTES - self.reserved_bytes
+
+    def fits(self, item) -> bool:
+        """True when the size of the item can be reserved now."""
+        return (item.get("size") or 0) <= self.get_available()
+
+    def reserve(self, item) -> bool:
+        """Reserve the size of the item, False when there is not enough space left for it."""
+        size = item.get("size") or 0
+        # Checked and reserved at once, downloads reserve from several workers
+        with self.lock:
+            if size > self.available():
+                return False
+            self.reserved[item["id"]] = self.reserved.get(item["id"], 0) + size
+            self.reserved_bytes += size
+        return True
+
+    def release(self, item, written: int = 0):
+        """End the reservation of an item, written is the number of bytes its download wrote to disk."""
+        with self.lock:
+            self.reserved_bytes -= self.reserved.pop(item["id"], 0)
+            self.free -= written  # Until the next sample sees them
+
+    def refresh(self):
+        with self.lock:
+            self.sample()
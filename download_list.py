@@ -9,33 +9,58 @@ import urllib.parse
 import threading
 from pathlib import Path
 from datetime import datetime, timezone
-from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, TimeoutError
 from dateutil import parser as datetimeparser
-from onedrive_authorization_utils import load_access_token_from_file,load_refresh_token_from_file,get_new_access_token_using_refresh_token,save_access_token
+from onedrive_authorization_utils import load_access_token_from_file,load_refresh_token_from_file,get_new_access_token_using_refresh_token,save_access_token,BASE_URL,refresh_access_token
 from generate_list import refresh_download_url
 from filedate import File
 from contextlib import closing
 
-import config,utils
+import urllib3
+import config,utils,catalog,graph_batch,http_client,concurrency,retry_policy,buffer_pool,file_hashes,local_index,disk_space,transfers,staged_files,file_writer,bandwidth,dedup,relocation
 
 log = logging.getLogger(__name__)
 lock_download = threading.Lock()
+url_refresher = None
+# Files and directories of the backup folder, see local_index.py
+local_files = None
+# Disk space reserved by the downloads in flight, see disk_space.py
+space_accountant = None
+# Complete downloads are renamed into place by it, see staged_files.py
+committer = None
+# Identical files are linked instead of downloaded by it when DEDUP_MODE is on, see dedup.py
+deduplicator = None
+# Files moved or renamed on OneDrive are moved locally by it when RELOCATE_MOVED is on, see relocation.py
+relocator = None
+# Small and large files are downloaded in separate lanes, see DownloadLane
+small_lane = None
+large_lane = None
+WINDOW_FACTOR = 2  # Items queued per lane, in multiples of its most workers
+WAIT_INTERVAL = 0.5  # Seconds between two checks of the stop flag while the windows are full
+PART_SUFFIX = ".part"
 
-# TO DO check item_download_errors and add lock
 
+class DownloadInterrupted(Exception):
+    """The stop flag was set during a download, its partial file is kept to resume it."""
 
-def load_file_list(perror) -> list:
-    if perror==1:
-        filelist="item_download_errors.json"
-    else:
-        filelist="file_list.json"
-    log.info(f"Loading {filelist}")
+
+class NotEnoughSpace(Exception):
+    """The item needs a download and its size does not fit in the free space yet, it waits in its lane."""
+
+
+class RangeNotSupported(Exception):
+    """The server sent the whole file to a Range request, segments cannot be fetched separately."""
+
+
+def load_file_list(perror) -> int:
+    """Count the files to download from the catalog, they are then read page by page with catalog.iter_files."""
+    status = catalog.STATUS_ERROR if perror==1 else None
+    log.info(f"Loading {'last errors' if status else 'files'} from catalog")
     for attempt in range(config.MAX_RETRIES):
         try:
-            with open(filelist, "r", encoding='utf8') as f:
-                config.file_list=json.load(f)
-                log.debug(f"config.file_list length is {len(config.file_list)}")
-                return config.file_list
+            nb_items = catalog.count_files(status)
+            log.debug(f"Catalog has {nb_items} files to process")
+            return nb_items
         except Exception as e:
             log.warning(f"Error loading file list, attempt {attempt + 1}")
             time.sleep( 5 * attempt) 
@@ -45,78 +70,349 @@ def load_file_list(perror) -> list:
 def refresh_url_from_fileid(fileid):
     download_url=None
     try:
-        headers = {"Authorization": "Bearer " + config.accesstoken}
-        url=f"https://graph.microsoft.com/v1.0/me/drive/items/{fileid}"
-        response = requests.get(url, headers=headers)
-        data = response.json()
-        download_url=data.get('@microsoft.graph.downloadUrl')
+        download_url=graph_batch.fetch_download_urls([fileid], config.accesstoken).get(fileid)
     except Exception as e:
         log.error(f"Error checking {fileid}")
         log.error("Traceback: %s", traceback.format_exc())
     return download_url
 
-def download_file_by_url(url, local_file_path, item):
-    access_token = config.accesstoken
-    headers = {"Authorization": "Bearer " + access_token}
+def get_response(graph_url, item, **kwargs):
+    """GET reporting the outcome to the limiter of the item lane, the latency is the time to the response headers."""
+    limiter = get_lane(item).limiter
+    try:
+        response = http_client.get(graph_url, **kwargs)
+    except requests.exceptions.RequestException:
+        limiter.record(None)
+        raise
+    limiter.record(response.status_code, response.elapsed.total_seconds(),
+                   graph_batch.get_retry_after(response.headers, None))
+    return response
 
-    # Use Microsoft Graph endpoint for download
+def stream_response(response, f, length=None, on_chunk=None, size_hint=None) -> int:
+    """Write up to length bytes of a streamed response body to f, return the number of bytes written.
+
+    The body is read into a buffer of the shared pool (buffer_pool.py), sized for length
+    or, when the whole body is read, for size_hint. Reads follow the measured throughput
+    and take their bytes from the bandwidth limiter (bandwidth.py).
+    on_chunk(written) is called after each write.
+    """
+    # Decoding reads until the buffer is full and loses what it read when the connection drops,
+    # without it a read returns the bytes received so far and they are written before the error
+    response.raw.decode_content = "Content-Encoding" in response.headers
+    pool = buffer_pool.get_pool()
+    buffer = pool.acquire(buffer_pool.get_buffer_size(length if length is not None else size_hint))
+    if buffer is None:
+        raise DownloadInterrupted("Stopped while waiting for a download buffer")
+    view = memoryview(buffer)
+    chunk_size = min(len(buffer), config.MIN_CHUNK_SIZE * 4)
+    written = 0
+    try:
+        while length is None or written < length:
+            size = chunk_size if length is None else min(chunk_size, length - written)
+            started = time.monotonic()
+            bandwidth.limiter.consume(size)
+            read = response.raw.readinto(view[:size])
+            if read < size:
+                bandwidth.limiter.refund(size - read)
+            if not read:
+                break
+            f.write(view[:read])
+            written += read
+            if on_chunk:
+                on_chunk(written)
+            chunk_size = buffer_pool.next_chunk_size(read, time.monotonic() - started, len(buffer))
+    except urllib3.exceptions.DecodeError as e:
+        raise requests.exceptions.ContentDecodingError(e)
+    except urllib3.exceptions.HTTPError as e:
+        # As iter_content does, a body cut short is a requests error to retry
+        raise requests.exceptions.ChunkedEncodingError(e)
+    finally:
+        view.release()
+        pool.release(buffer)
+    return written
+
+def uses_download_url(url, item) -> bool:
+    """True when the pre-authenticated download url is still valid, no token and no redirect needed."""
+    return bool(url) and not graph_batch.is_download_url_expiring(item, margin=0)
+
+def fetch_file(url, local_file_path, item, access_token):
+    """Download the item to the .part file of local_file_path and return its path, raising on any error."""
     fileid = item["id"]
     filesize = item["size"]
-    graph_url = f"https://graph.microsoft.com/v1.0/me/drive/items/{fileid}/content"
+    if uses_download_url(url, item):
+        graph_url = url
+        headers = {}
+    else:
+        # Use Microsoft Graph endpoint for download
+        graph_url = f"{BASE_URL}me/drive/items/{fileid}/content"
+        headers = {"Authorization": "Bearer " + access_token}
 
+    part_path, state_path = get_part_paths(local_file_path)
+    if filesize < config.RESUME_MIN_SIZE:  # Small files start over after a failure, without a resume state
+        response = get_response(graph_url, item, stream=True, headers=headers, allow_redirects=True, timeout=config.TIMEOUT)
+        with closing(response):
+            response.raise_for_status()
+            try:
+                with open(part_path, 'wb') as f:
+                    stream_response(response, f, on_chunk=transfers.registry.get(fileid).set, size_hint=filesize)
+            except Exception:
+                # Nothing to resume from, a later attempt writes it again
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise
+    elif filesize >= config.SEGMENTED_MIN_SIZE and config.SEGMENT_COUNT > 1:
+        log.info("Very big file identified, downloading segments in parallel")
+        try:
+            SegmentedDownload(graph_url, headers, local_file_path, item).run()
+        except RangeNotSupported as e:
+            log.warning(f"{e}, downloading in one stream")
+            fetch_resumable(graph_url, headers, local_file_path, item)
+    else:
+        log.info("Big file identified, downloading in chunks")
+        fetch_resumable(graph_url, headers, local_file_path, item)
+    return part_path
+
+def get_part_paths(local_file_path):
+    """Partial download and its state: item id, eTag and the byte ranges saved so far."""
+    part_path = local_file_path + PART_SUFFIX
+    return part_path, part_path + ".json"
+
+def load_resume_segments(item, part_path, state_path) -> list:
+    """Byte ranges [start, end, position] of the partial download, position is the next byte to fetch.
+
+    Empty when there is no partial download or when it must start over.
+    """
     try:
-        if filesize < 100*1024*1024:  # Small files (<100MB) downloaded in one go
-            r = requests.get(graph_url, headers=headers, allow_redirects=True, timeout=config.TIMEOUT)
-            r.raise_for_status()
-            with open(local_file_path, 'wb') as f:
-                f.write(r.content)
-        else:
-            log.info("Big file identified, downloading in chunks")
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+        part_size = os.path.getsize(part_path)
+    except (OSError, ValueError):
+        return []
+    if state.get("id") != item["id"] or state.get("eTag") != item.get("eTag"):
+        log.info(f"{item['id']} changed on OneDrive since its partial download, starting over")
+        return []
+    # Positions are only saved once flushed, a shorter file means it was not
+    return [[start, end, max(start, min(position, part_size))] for start, end, position in state.get("segments", [])]
+
+def save_resume_segments(item, state_path, segments):
+    temp_path = state_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"id": item["id"], "eTag": item.get("eTag"), "segments": segments}, f)
+    os.replace(temp_path, state_path)
+
+def get_contiguous_size(segments) -> int:
+    """Bytes saved from the start of the file without a gap."""
+    size = 0
+    for start, end, position in sorted(segments):
+        if start != size:
+            break
+        size = position
+        if position < end:
+            break
+    return size
+
+def get_range_start(response):
+    """Start offset of a 206 response, None when the server sent the whole file."""
+    if response.status_code != 206:
+        return None
+    try:
+        return int(response.headers["Content-Range"].split()[1].split("-")[0])
+    except (KeyError, IndexError, ValueError):
+        return None
 
-            downloaded_size = 0
-            chunk_size = 10*1024 * 1024  # 10MB
-            log_interval = filesize / 100  # Log every 1% of the total size
-            next_log_threshold = log_interval  # First log threshold
+def fetch_resumable(graph_url, headers, local_file_path, item):
+    """Stream a big file to a .part file, continuing a previous partial download with a Range request.
 
-            response = requests.get(graph_url, stream=True, headers=headers, allow_redirects=True, timeout=config.TIMEOUT)
+    The offset saved next to the .part file only counts bytes flushed to disk. The .part file is
+    complete when this returns, and is discarded when the item eTag changed.
+    """
+    filesize = item["size"]
+    part_path, state_path = get_part_paths(local_file_path)
+    offset = get_contiguous_size(load_resume_segments(item, part_path, state_path))
+    if offset >= filesize > 0:
+        # Complete before the previous run could rename it
+        return
+    if offset:
+        headers = dict(headers, Range=f"bytes={offset}-")
+
+    response = get_response(graph_url, item, stream=True, headers=headers, allow_redirects=True, timeout=config.TIMEOUT)
+    response.raise_for_status()
+    if offset and get_range_start(response) != offset:
+        log.info(f"Range not honoured for {item['id']}, starting over")
+        offset = 0
+    elif offset:
+        log.info(f"Resuming download of {item['id']} at {offset} bytes")
+
+    downloaded_size = checkpoint = offset
+    transfer = transfers.registry.get(item["id"])
+    transfer.resume(offset)
+
+    def on_chunk(written):
+        nonlocal downloaded_size, checkpoint
+        downloaded_size = offset + written
+        transfer.set(downloaded_size)
+        if downloaded_size - checkpoint >= config.RESUME_CHECKPOINT:
+            writer.sync()
+            save_resume_segments(item, state_path, [[0, filesize, downloaded_size]])
+            checkpoint = downloaded_size
+        if config.stop_flag:
+            raise DownloadInterrupted(f"Download of {item['id']} stopped at {downloaded_size} bytes")
+
+    # Closing the response gives the connection back to the shared pool
+    with closing(response), file_writer.PartWriter(part_path, filesize, keep=offset) as writer:
+        try:
+            stream_response(response, writer.at(offset), filesize - offset, on_chunk)
+        finally:
+            if downloaded_size > checkpoint:
+                writer.sync()
+                save_resume_segments(item, state_path, [[0, filesize, downloaded_size]])
+    if downloaded_size < filesize:
+        raise requests.exceptions.ChunkedEncodingError(f"Connection closed at {downloaded_size} of {filesize} bytes")
+
+
+class SegmentedDownload:
+    """Download byte ranges of one file concurrently, each over its own connection.
+
+    The .part file is allocated to the full size and the segments write at their offsets
+    through one PartWriter. Segment positions are saved like fetch_resumable offsets,
+    an interrupted download continues each segment where it stopped.
+    """
+
+    def __init__(self, graph_url, headers, local_file_path, item):
+        self.graph_url = graph_url
+        self.headers = headers
+        self.local_file_path = local_file_path
+        self.item = item
+        self.transfer = transfers.registry.get(item["id"])
+        self.part_path, self.state_path = get_part_paths(local_file_path)
+        self.lock = threading.Lock()
+        self.segments = []
+        self.writer = None
+
+    def plan_segments(self, saved_segments):
+        """Keep the saved segments, or split what a single stream did not download yet."""
+        if len(saved_segments) > 1:
+            return saved_segments
+        filesize = self.item["size"]
+        offset = get_contiguous_size(saved_segments)
+        if offset >= filesize:
+            # Complete before the previous run could rename it
+            return [[0, filesize, filesize]]
+        step = -(-(filesize - offset) // config.SEGMENT_COUNT)
+        segments = [[0, offset, offset]] if offset else []
+        for start in range(offset, filesize, step):
+            segments.append([start, min(start + step, filesize), start])
+        return segments
+
+    def save(self):
+        with self.lock:
+            save_resume_segments(self.item, self.state_path, self.segments)
+
+    def run(self):
+        self.segments = self.plan_segments(load_resume_segments(self.item, self.part_path, self.state_path))
+        size = self.item["size"]
+        # Keeps the bytes of the saved segments, fills the holes of the file
+        self.writer = file_writer.PartWriter(self.part_path, size, keep=size)
+        self.save()
+        self.transfer.resume(sum(position - start for start, end, position in self.segments))
+        remaining = [segment for segment in self.segments if segment[2] < segment[1]]
+        log.debug(f"Downloading {len(remaining)} segments of {self.item['id']}")
+        errors = []
+        with self.writer, ThreadPoolExecutor(max_workers=max(len(remaining), 1)) as executor:
+            for future in as_completed([executor.submit(self.fetch_segment, segment) for segment in remaining]):
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            # Interruption and unsupported ranges are handled before network errors
+            errors.sort(key=lambda e: not isinstance(e, (DownloadInterrupted, RangeNotSupported)))
+            raise errors[0]
+
+    def fetch_segment(self, segment):
+        start, end, position = segment
+        start_position = position
+        headers = dict(self.headers, Range=f"bytes={position}-{end - 1}")
+        response = get_response(self.graph_url, self.item, stream=True, headers=headers, allow_redirects=True, timeout=config.TIMEOUT)
+        with closing(response):
             response.raise_for_status()
-            with open(local_file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=chunk_size):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded_size += len(chunk)
-
-                        # Log progress at every 1% increment
-                        if downloaded_size >= next_log_threshold:
-                            with lock_download:
-                                index = next((i for i, entry in enumerate(config.downloadinprogress) if entry["id"] == fileid), None)
-                                config.downloadinprogress[index]["downloaded"] = downloaded_size
-                            next_log_threshold += log_interval  # Update next threshold
-
-        return local_file_path
-
-    except requests.exceptions.HTTPError as http_err:
-        if http_err.response.status_code == 404:
-            log.warning(f"HTTP error {http_err.response.status_code}: {http_err}")
-            new_url = refresh_download_url(url)
-            if new_url and new_url != url:
-                log.info(f"Trying refreshed URL {new_url}")
-                return download_file_by_url(new_url, local_file_path, item)
-        else:
-            log.error(f"HTTP Error {http_err}")
-    
-    except requests.exceptions.RequestException as e:
-        log.error(f"Request failed for {url}: {e}")
-    
-    except Exception as e:
-        log.error(f"Error processing {local_file_path.encode('utf-8')}")
-        log.error("Traceback: %s", traceback.format_exc())
-        config.num_error += 1
+            if get_range_start(response) != position:
+                raise RangeNotSupported(f"Range not honoured for {self.item['id']}")
 
-    return None
+            def on_chunk(written):
+                nonlocal position
+                self.transfer.add(start_position + written - position)
+                position = start_position + written
+                if position - segment[2] >= config.RESUME_CHECKPOINT:
+                    self.checkpoint(segment, position)
+                if config.stop_flag:
+                    raise DownloadInterrupted(f"Download of {self.item['id']} stopped")
+
+            try:
+                stream_response(response, self.writer.at(position), end - position, on_chunk)
+            finally:
+                if position > segment[2]:
+                    self.checkpoint(segment, position)
+        if position < end:
+            raise requests.exceptions.ChunkedEncodingError(f"Connection closed at {position} in segment {start}-{end}")
+
+    def checkpoint(self, segment, position):
+        """Save the position of a segment once its bytes are on disk."""
+        self.writer.sync()
+        segment[2] = position
+        self.save()
+
+def download_file_by_url(url, local_file_path, item):
+    """Download the item to a staged file, failures are retried according to retry_policy.
+
+    Return the path of the staged file, None when it failed.
+    """
+    fileid = item["id"]
+    transfer = transfers.registry.get(fileid)
+    retry = retry_policy.Retry(f"Download {fileid}")
+    while True:
+        access_token = config.accesstoken
+        with_download_url = uses_download_url(url, item)
+        downloaded = transfer.downloaded
+        try:
+            return fetch_file(url, local_file_path, item, access_token)
+        except DownloadInterrupted as e:
+            log.info(f"{e}, it will resume on the next run")
+            return None
+        except Exception as e:
+            failure_class, retry_after = retry_policy.classify(e)
+            if transfer.downloaded > downloaded:
+                # A resumable download that progressed keeps its retries
+                retry.reset()
+            if failure_class == retry_policy.PERMANENT and not isinstance(e, requests.exceptions.RequestException):
+                log.error(f"Error processing {local_file_path.encode('utf-8')}")
+                log.error("Traceback: %s", traceback.format_exc())
+                return None
+            if failure_class == retry_policy.NOT_FOUND and not with_download_url:
+                log.error(f"{fileid} not found on OneDrive: {e}")
+                return None
+            if not retry.wait(failure_class, retry_after):
+                log.error(f"Download of {local_file_path.encode('utf-8')} failed: {e}")
+                return None
+        if failure_class in (retry_policy.AUTH_EXPIRED, retry_policy.NOT_FOUND):
+            if with_download_url:
+                # Expired or changed pre-authenticated url
+                new_url = refresh_download_url(url, fileid)
+                if not new_url:
+                    log.error(f"No download url for {fileid}, deleted since the listing ?")
+                    return None
+                log.info(f"Trying refreshed URL {new_url}")
+                item["@microsoft.graph.downloadUrl"] = new_url
+                item[graph_batch.DOWNLOAD_URL_FETCHED] = time.time()
+                url = new_url
+            else:
+                refresh_access_token(access_token)
 
 def ensure_local_path_exists(local_path):
-    Path(local_path).mkdir(parents=True, exist_ok=True)
+    if local_files:
+        local_files.makedirs(local_path)
+    else:
+        Path(local_path).mkdir(parents=True, exist_ok=True)
 
 def get_local_download_folder_by_item(item) -> str:
     master_parent_folder_name = "/drive/root:"
@@ -156,21 +452,95 @@ def is_file_excluded(exclusion_list,filepath):
     filepath=filepath.lower()
     return any(substring.lower() in filepath for substring in exclusion_list)
 
+def get_local_stat(local_file_path):
+    """Stat of a local file from the index when there is one, None when the file does not exist."""
+    if local_files:
+        return local_files.stat(local_file_path)
+    try:
+        return os.stat(local_file_path)
+    except OSError:
+        return None
+
 def is_file_changed(item, local_file_path):
-    file_path = Path(local_file_path)
-    if not file_path.exists():
+    stat = get_local_stat(local_file_path)
+    if stat is None:
+        return True
+    if item["size"] != stat.st_size:
         return True
+    if config.HASH_CHECK:
+        # Same size edits are found and drifting dates do not cause downloads
+        same_content = file_hashes.is_same_content(item, local_file_path, stat)
+        if same_content is not None:
+            return not same_content
     item_last_modified = to_utc_aware(datetime.fromisoformat(item["lastModifiedDateTime"]))
-    file_size = file_path.stat().st_size
-    file_last_modified = to_utc_aware(datetime.fromtimestamp(file_path.stat().st_mtime))
-    delta_sec = (file_last_modified - item_last_modified).total_seconds()
-    return not (item["size"] == file_size and abs(delta_sec) < 60)
+    if abs(stat.st_mtime - item_last_modified.timestamp()) < 60:
+        return False
+    if deduplicator:
+        # Hard linked copies keep the dates of the first copy
+        return not file_hashes.is_same_content(item, local_file_path, stat)
+    return True
 
 
-def process_item(item):
+class DownloadLane:
+    """Downloads of one size class, with their own workers and concurrency limit.
+
+    Its items are counted in a group of the transfers registry, for its estimated time left.
+    """
+
+    def __init__(self, name, initial, maximum, min_size=None, max_size=None, largest_first=False):
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.largest_first = largest_first
+        self.limiter = concurrency.create(name, initial, maximum)
+        self.window = WINDOW_FACTOR * self.limiter.maximum
+        self.futures = set()
+        self.waiting = []  # Items held back until there is free space for them
+        # Workers block in the limiter while its limit is below their number, unchanged files are checked meanwhile
+        self.executor = ThreadPoolExecutor(max_workers=self.limiter.maximum)
+        self.lock = threading.Lock()
+        self.group = None
+
+    def iter_files(self, status):
+        if self.largest_first:
+            return catalog.iter_files_by_size(status, self.min_size, self.max_size)
+        return catalog.iter_files(status, self.min_size, self.max_size)
+
+    def process(self, func, item):
+        transfer = transfers.registry.begin(item, self.name)
+        processed = True
+        try:
+            return func(item)
+        except NotEnoughSpace:
+            processed = False  # Submitted again once there is space for it
+            raise
+        finally:
+            transfers.registry.end(transfer, processed)
+            space_accountant.release(item, transfer.written)
+
+    def log_summary(self):
+        self.limiter.log_summary()
+        if self.group:
+            elapsed = time.monotonic() - self.group.started
+            log.info(f"{self.name}: {self.group.files_downloaded} files, {self.group.bytes_written // (1024 * 1024)} MB downloaded in {elapsed:.0f}s")
+
+def get_lane(item) -> DownloadLane:
+    return large_lane if (item.get("size") or 0) >= config.LARGE_FILE_MIN_SIZE else small_lane
+
+def get_progress_status() -> str:
+    status = f"Files processed: {config.progress_num} of {config.progress_tot}"
+    eta = transfers.registry.get_eta()
+    if eta:
+        status += f", about {utils.format_duration(eta)} left"
+    return status
+
+def process_item(item, defer=True):
+    """Download an item when it changed, True once processed, None when deferred to the deduplication pass."""
+    if url_refresher:
+        url_refresher.discard(item)
     try:
         filename = "To Be Set"
-        config.status_str = f"Files processed: {config.progress_num} of {config.progress_tot}"
+        config.status_str = get_progress_status()
         if config.progress_num % 100 == 0:  # Only update every 100 files
             log.info(config.status_str)
         
@@ -202,98 +572,258 @@ def process_item(item):
                 local_file_path = os.path.join(local_folder_path, filename)
                 ensure_local_path_exists(local_folder_path)
                 
-                if is_file_changed(item, local_file_path):
+                previous_path = relocator.get_previous_path(item, local_file_path) if relocator else None
+                if not is_file_changed(item, local_file_path):
+                    outcome = None
+                elif previous_path and not is_file_changed(item, previous_path) and relocator.move(item, previous_path, local_file_path):
+                    outcome = relocation.MOVED
+                elif deduplicator:
+                    outcome = deduplicator.prepare(item, local_file_path, defer)
+                else:
+                    outcome = dedup.DOWNLOAD
+                
+                if outcome == dedup.DEFERRED:
+                    log.info(f"Identical to a file being downloaded, linked after it: {filename_enc}")
+                    catalog.set_status(fileid, catalog.STATUS_DEDUP)
+                    return None
+                if outcome == relocation.MOVED:
+                    # Renaming an item on OneDrive can change its dates
+                    update_file_dates(local_file_path, item)
+                    if config.HASH_CHECK or deduplicator:
+                        file_hashes.remember(item, local_file_path)
+                    log.info(f"Moved from {os.path.normpath(previous_path).encode('utf-8')}: {os.path.normpath(local_file_path).encode('utf-8')}")
+                elif outcome in (dedup.HARDLINKED, dedup.CLONED):
+                    if outcome == dedup.CLONED:
+                        # A reflink is a file of its own, with the dates of its item
+                        update_file_dates(local_file_path, item)
+                    log.info(f"Linked ({outcome}): {os.path.normpath(local_file_path).encode('utf-8')}")
+                elif outcome == dedup.DOWNLOAD:
+                    if not space_accountant.reserve(item):
+                        if deduplicator:
+                            deduplicator.release(item)
+                        raise NotEnoughSpace(f"Not enough free space for {filename_enc} yet, holding it back")
                     log.debug(f"Downloading {filename.encode('utf-8')}")
                     
-                    with lock_download:  # Ensuring thread safety
-                        config.downloadinprogress.append(item)
+                    transfers.registry.get(fileid).start()
                     
                     filesizemb = item["size"] / 1024 / 1024
                     if filesizemb > 100:
                         log.info(f"Processing file {filename_enc} of {int(filesizemb)}Mb")
                     
-                    downloaded_file = download_file_by_url(download_url, local_file_path,item)
-                    
-                    with lock_download:  # Ensuring thread safety
-                        config.downloadinprogress = [entry for entry in config.downloadinprogress if entry["id"] != fileid]
+                    with get_lane(item).limiter.slot():
+                        downloaded_file = download_file_by_url(download_url, local_file_path,item)
                     
                     if downloaded_file:
-                        update_file_dates(local_file_path, item)
+                        # Dates, inode and hash of the staged file are kept by the rename
+                        update_file_dates(downloaded_file, item)
+                        if config.HASH_CHECK or deduplicator:
+                            file_hashes.remember(item, downloaded_file)
+                        committer.commit(downloaded_file, local_file_path, get_part_paths(local_file_path)[1], fileid)
                         local_file_path = os.path.normpath(local_file_path)
                         log.info(f"Downloaded: {local_file_path.encode('utf-8')}")
                     else:
+                        if deduplicator:
+                            deduplicator.release(item)
+                        catalog.set_status(fileid, catalog.STATUS_ERROR)
                         with lock_download:  # Ensuring thread safety
-                            config.item_download_errors.append(item)
                             config.num_error += 1
+                        config.progress_num += 1
+                        return False
                 else:
+                    if deduplicator:
+                        deduplicator.add_source(item, local_file_path)
                     log.info(f"Unchanged: {filename_enc}")
+                if relocator and outcome != relocation.MOVED:
+                    relocator.record(item, local_file_path)
                 
         config.progress_num += 1
+        return True
     
+    except NotEnoughSpace:
+        raise
     except Exception as e:
         log.error(f"Error processing {filename_enc if 'filename_enc' in locals() else 'unknown'}")
         log.error("Traceback: %s", traceback.format_exc())
         
         with lock_download:  # Ensuring thread safety
-            config.downloadinprogress = [entry for entry in config.downloadinprogress if entry["id"] != fileid]
-            config.item_download_errors.append(item)
             config.num_error += 1
+        catalog.set_status(item.get("id"), catalog.STATUS_ERROR)
+    return False
+
+
+def link_deferred_item(item):
+    """Process an item deferred by the deduplication, once the first copy of its content is in place."""
+    if process_item(item, defer=False):
+        catalog.set_status(item["id"], None)
+
+def replay_item(item):
+    """Process an item of the last errors, clearing its error status once it is processed."""
+    if process_item(item):
+        catalog.set_status(item["id"], None)
         
 
-def safe_submit(executor, func, item):
-    """Submit a task only if there is enough disk space and stop_flag is False."""
-    if config.stop_flag:
-        log.warning("Stop flag is set. Skipping new downloads.")
-        return None  # Prevent new tasks from being submitted
-    
-    if not utils.has_enough_space(get_local_download_folder_by_item(item)):
-        log.error("Low disk space. Stopping downloads...")
-        config.stop_flag = True  # Set the stop flag to prevent further submissions
-        return None
-    
-    return executor.submit(func, item)
+def safe_submit(lane, func, item):
+    """Submit a task to the lane, its size is reserved on disk once it needs a download."""
+    url_refresher.add(item)
+    return lane.executor.submit(lane.process, func, item)
+
+def give_up_waiting(lanes):
+    """End a run without space left for the items waiting for it."""
+    for lane in lanes:
+        for item in lane.waiting:
+            log.error(f"Not enough free space to download {item['name'].encode('utf-8')} ({item['size'] // (1024 * 1024)} MB)")
+            catalog.set_status(item["id"], catalog.STATUS_ERROR)
+            with lock_download:
+                config.num_error += 1
+            config.progress_num += 1
+        if lane.waiting and not lane.largest_first:
+            log.error("Low disk space. Stopping downloads...")
+            config.stop_flag = True
+
+def run_lanes(lanes, status, func):
+    """Feed the lanes from the catalog, keeping at most a window of queued items per lane.
+
+    Items are read from the catalog as the downloads progress, and the stop flag is
+    checked at least every WAIT_INTERVAL. The items still queued are cancelled by the caller.
+    Items that need a download and do not fit in the free space come back to wait in their
+    lane while the downloads in flight go on: the large files lane goes on with the next,
+    smaller, files, the small files lane waits for its first item. They are submitted again
+    once they fit, the run ends when nothing in flight can free space for them.
+    """
+    # Large files come first and largest first: the longest downloads start at once,
+    # beside the small files, instead of queuing behind them or ending the run alone
+    sources = {}
+    for lane in lanes:
+        lane.group = transfers.registry.add_group(lane.name, catalog.sum_file_sizes(status, lane.min_size, lane.max_size))
+        sources[lane] = lane.iter_files(status)
+    pending = {}
+
+    def submit(lane, item):
+        future = safe_submit(lane, func, item)
+        lane.futures.add(future)
+        pending[future] = (lane, item)
+
+    def submit_waiting():
+        # Space released by the downloads ended goes to the items waiting first
+        for lane in lanes:
+            waiting, lane.waiting = lane.waiting, []
+            for item in waiting:
+                if len(lane.futures) < lane.window and space_accountant.fits(item):
+                    submit(lane, item)
+                else:
+                    lane.waiting.append(item)
+
+    while not config.stop_flag:
+        submit_waiting()
+        for lane, source in list(sources.items()):
+            while len(lane.futures) < lane.window and not config.stop_flag:
+                if lane.waiting and not lane.largest_first:
+                    break
+                item = next(source, None)
+                if item is None:
+                    del sources[lane]
+                    break
+                submit(lane, item)
+        if not pending:
+            if not any(lane.waiting for lane in lanes):
+                return
+            # Nothing in flight: the items waiting only fit if space was freed meanwhile
+            space_accountant.refresh()
+            submit_waiting()
+            if not pending:
+                give_up_waiting(lanes)
+                return
+            continue
+        done, _ = wait(pending, timeout=WAIT_INTERVAL, return_when=FIRST_COMPLETED)
+        committer.flush_if_due()
+        for future in done:
+            lane, item = pending.pop(future)
+            lane.futures.discard(future)
+            try:
+                future.result()
+            except NotEnoughSpace as e:
+                log.warning(str(e))
+                lane.waiting.append(item)
+            except Exception as e:
+                log.error(f"Error in download executor: {e}")
+                log.error("Traceback: %s", traceback.format_exc())
+    log.warning("Stop flag detected. Cancelling remaining downloads.")
 
 def download_the_list_of_files(perror):
     log.info("Download process Started.")
+    retry_policy.reset_stats()
     config.status_str = "Loading files list"
-    items = load_file_list(perror)
+    nb_items = load_file_list(perror)
     config.status_str = "Downloads start"
-    if not items or len(items) == 0:
+    if not nb_items:
         log.error("No items in file")
         return
 
-    config.progress_tot = len(items)
+    config.progress_tot = nb_items
     config.progress_num = 0
-    log.info("Starting download of %s file(s).", len(items))
-    log.debug("First one is %s", get_local_download_folder_by_item(items[0]))
+    log.info("Starting download of %s file(s).", nb_items)
 
-    with ThreadPoolExecutor(max_workers=config.MAX_WORKERS) as executor:
-        try:
-            futures = {}
-            index = 0
-            while index < len(items) and not config.stop_flag:
-                item = items[index]
-                future = safe_submit(executor, process_item, item)
-                if future:
-                    futures[future] = item
-                index += 1
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                    if config.stop_flag:
-                        log.warning("Stop flag detected. Cancelling remaining downloads.")
-                        executor.shutdown(wait=True, cancel_futures=True)
-                except Exception as e:
-                    log.error(f"Error in download executor: {e}")
-                    log.error("Traceback: %s", traceback.format_exc())
-        except Exception as e:
-            log.error(f"Unexpected error during download process: {e}")
+    if perror==1:
+        status, func = catalog.STATUS_ERROR, replay_item
+    else:
+        # A full run records its own errors, and defers its own duplicates
+        catalog.clear_status(catalog.STATUS_ERROR)
+        catalog.clear_status(catalog.STATUS_DEDUP)
+        status, func = None, process_item
+
+    global url_refresher, small_lane, large_lane, local_files, space_accountant, committer, deduplicator, relocator
+    space_accountant = disk_space.SpaceAccountant(config.OFFLINEBACKUP_PATH)
+    committer = staged_files.FileCommitter()
+    deduplicator = dedup.Deduplicator() if config.DEDUP_MODE != dedup.DEDUP_OFF else None
+    transfers.registry.start_run()
+    if config.LOCAL_INDEX:
+        config.status_str = "Listing local files"
+        local_files = local_index.LocalIndex(config.OFFLINEBACKUP_PATH).build()
+    relocator = relocation.Relocator(config.OFFLINEBACKUP_PATH, local_files) if config.RELOCATE_MOVED else None
+    url_refresher = graph_batch.DownloadUrlRefresher()
+    large_lane = DownloadLane("Large downloads", config.MAX_WORKERS_LARGE, config.MAX_WORKERS_LARGE_LIMIT,
+                              min_size=config.LARGE_FILE_MIN_SIZE, largest_first=True)
+    small_lane = DownloadLane("Downloads", config.MAX_WORKERS, config.MAX_WORKERS_LIMIT, max_size=config.LARGE_FILE_MIN_SIZE)
+    lanes = (large_lane, small_lane)
+    started = time.monotonic()
+    try:
+        run_lanes(lanes, status, func)
+        if deduplicator and not config.stop_flag and catalog.count_files(catalog.STATUS_DEDUP):
+            # The first copies are in place before their duplicates are linked to them
+            committer.flush()
+            log.info("Linking the files identical to the files downloaded")
+            run_lanes(lanes, catalog.STATUS_DEDUP, link_deferred_item)
+    except Exception as e:
+        log.error(f"Unexpected error during download process: {e}")
+        log.error("Traceback: %s", traceback.format_exc())
+    finally:
+        for lane in lanes:
+            lane.executor.shutdown(wait=True, cancel_futures=True)
+        committer.flush()
+    if relocator:
+        relocator.clean_up(committer.failed)
+    url_refresher.stop()
+    url_refresher = None
+    local_files = None
+    log.info(f"Free space sampled {space_accountant.samples} times")
+    for lane in lanes:
+        lane.log_summary()
     
-    if config.item_download_errors:
-        with open('item_download_errors.json', 'w', encoding="utf8") as f:
-            json.dump(config.item_download_errors, f, indent=2)
-        log.info("Errors logged in item_download_errors.json.")
+    nb_errors = catalog.count_files(catalog.STATUS_ERROR)
+    if nb_errors:
+        log.info(f"{nb_errors} errors logged in catalog.")
     
+    http_client.log_stats()
+    buffer_pool.log_stats()
+    committer.log_stats()
+    if deduplicator:
+        deduplicator.log_stats()
+    deduplicator = None
+    if relocator:
+        relocator.log_stats()
+    relocator = None
+    bandwidth.limiter.log_stats(transfers.registry.get_totals()[0] / (time.monotonic() - started))
+    retry_policy.log_stats()
     log.info("Download process completed.")
     if config.stop_flag:
         config.status_str = "Downloads ended due to stop_flag"
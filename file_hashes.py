@@ -0,0 +1,136 @@
+import base64
+import hashlib
+import logging
+import os
+
+import catalog
+
+log = logging.getLogger(__name__)
+
+# Local content hashes, compared to the hashes OneDrive returns in item["file"]["hashes"].
+# Hashes are cached in the catalog with the stat of the file they were computed from:
+# a file is hashed again only when its device, inode, size or mtime changed.
+QUICK_XOR = "quickXorHash"
+SHA1 = "sha1Hash"
+SHA256 = "sha256Hash"
+READ_SIZE = 4 * 1024 * 1024
+
+WIDTH = 160  # quickXorHash is 160 bits, byte n of the file is xored at bit 11 * n modulo 160
+SHIFT = 11
+BLOCK_SIZE = WIDTH  # Bytes after which the bit positions repeat
+BLOCK_BITS = BLOCK_SIZE * 8
+SPAN_SIZE = 256 * BLOCK_SIZE  # Bytes xored at once before folding, larger spans are slower to fold
+MASK = (1 << WIDTH) - 1
+
+
+class QuickXorHash:
+    """quickXorHash of OneDrive for Business and Personal, with the hashlib interface.
+
+    Bytes 160 apart land at the same bit position, so each update xors its data down to
+    one 160 bytes block with big integer operations: spans of the data are xored together,
+    then the result is folded in halves. Only the 160 bytes of that block are shifted one by one.
+    """
+
+    def __init__(self, data=b""):
+        self.state = 0
+        self.length = 0
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        view = memoryview(data).cast("B")
+        size = len(view)
+        if not size:
+            return
+        full = size - size % BLOCK_SIZE
+        folded = 0
+        for start in range(0, full, SPAN_SIZE):
+            folded ^= int.from_bytes(view[start:min(start + SPAN_SIZE, full)], "little")
+        blocks = min(SPAN_SIZE, full) // BLOCK_SIZE
+        while blocks > 1:
+            half = blocks // 2
+            bits = half * BLOCK_BITS
+            folded = (folded & ((1 << bits) - 1)) ^ (folded >> bits)
+            blocks -= half
+        folded ^= int.from_bytes(view[full:], "little")
+        state = self.state
+        first = self.length % BLOCK_SIZE
+        for index, byte in enumerate(folded.to_bytes(BLOCK_SIZE, "little")):
+            if byte:
+                state ^= byte << (SHIFT * (first + index)) % WIDTH
+        # Bits shifted past 160 wrap around to the start
+        self.state = (state & MASK) ^ (state >> WIDTH)
+        self.length += size
+
+    def digest(self) -> bytes:
+        digest = bytearray(self.state.to_bytes(WIDTH // 8, "little"))
+        for index, byte in enumerate(self.length.to_bytes(8, "little")):
+            digest[WIDTH // 8 - 8 + index] ^= byte
+        return bytes(digest)
+
+    def b64digest(self) -> str:
+        """The digest as OneDrive returns it."""
+        return base64.b64encode(self.digest()).decode("ascii")
+
+
+def get_remote_hash(item):
+    """(hash name, value) of the item to compare local files with, None when OneDrive gave no hash."""
+    hashes = item.get("file", {}).get("hashes") or {}
+    for name in (QUICK_XOR, SHA1, SHA256):
+        if hashes.get(name):
+            return name, hashes[name]
+    return None
+
+
+def hash_file(path, name) -> str:
+    hasher = QuickXorHash() if name == QUICK_XOR else hashlib.new("sha1" if name == SHA1 else "sha256")
+    buffer = bytearray(READ_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            hasher.update(view[:read])
+    return hasher.b64digest() if name == QUICK_XOR else hasher.hexdigest().upper()
+
+
+def get_stat_key(stat) -> tuple:
+    # Device and inode numbers can exceed 64 bits signed (Windows, ReFS), they are kept as text
+    return str(stat.st_dev), str(stat.st_ino), stat.st_size, stat.st_mtime_ns
+
+
+def get_local_hash(path, stat, name) -> str:
+    """Hash of a local file, from the cache when its stat did not change."""
+    key = get_stat_key(stat)
+    cached = catalog.get_local_hash(key, name)
+    if cached:
+        return cached
+    value = hash_file(path, name)
+    catalog.set_local_hash(key, name, value)
+    return value
+
+
+def is_same_content(item, path, stat) -> bool:
+    """True when the local file hash is the one of the item, None when the item has no hash."""
+    remote = get_remote_hash(item)
+    if remote is None:
+        return None
+    name, value = remote
+    if not stat.st_ino:
+        stat = os.stat(path)  # Listed on Windows, where scandir gives no inode
+    local = get_local_hash(path, stat, name)
+    if name == QUICK_XOR:
+        return local == value
+    return local.upper() == value.upper()  # Hexadecimal digests
+
+
+def remember(item, path):
+    """Cache the item hash for a file just downloaded from it, it is not hashed again on the next run."""
+    remote = get_remote_hash(item)
+    if remote is None:
+        return
+    try:
+        catalog.set_local_hash(get_stat_key(os.stat(path)), *remote)
+    except OSError as e:
+        log.debug(f"No hash cached for {path.encode('utf-8')}: {e}")
@@ -0,0 +1,81 @@
+import os
+import logging
+import threading
+
+import config
+
+log = logging.getLogger(__name__)
+
+# Big downloads are written to their .part file through one descriptor, with positional
+# writes. The file is preallocated to the size of the item first: the file system gives
+# it large extents at once instead of growing it write by write between the writes of
+# the other downloads, and the segments of a file write at their offsets concurrently.
+
+
+class PartWriter:
+    """Positional writer of a .part file of size bytes, the first keep bytes of an existing file are kept."""
+
+    def __init__(self, path: str, size: int, keep: int = 0):
+        self.path = path
+        self.lock = threading.Lock()  # Seek and write are one step where there is no pwrite
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            os.ftruncate(self.fd, keep)
+            self.preallocate(size)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def preallocate(self, size: int):
+        if config.PREALLOCATE and size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(self.fd, 0, size)
+                return
+            except OSError as e:
+                log.debug(f"No preallocation for {self.path.encode('utf-8')}: {e}")
+        # Sets the size only, Windows allocates it
+        os.ftruncate(self.fd, size)
+
+    def write_at(self, data, offset: int) -> int:
+        view = memoryview(data)
+        size = len(view)
+        while view:
+            if hasattr(os, "pwrite"):
+                written = os.pwrite(self.fd, view, offset)
+            else:
+                with self.lock:
+                    os.lseek(self.fd, offset, os.SEEK_SET)
+                    written = os.write(self.fd, view)
+            view = view[written:]
+            offset += written
+        return size
+
+    def at(self, offset: int) -> "PartCursor":
+        return PartCursor(self, offset)
+
+    def sync(self):
+        os.fsync(self.fd)
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PartCursor:
+    """Sequential writes from an offset of a PartWriter, as file.write for stream_response."""
+
+    __slots__ = ("writer", "position")
+
+    def __init__(self, writer: PartWriter, position: int):
+        self.writer = writer
+        self.position = position
+
+    def write(self, data) -> int:
+        written = self.writer.write_at(data, self.position)
+        self.position += written
+        return written
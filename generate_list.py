@@ -10,26 +10,41 @@ from urllib.parse import quote,urlparse,urlunparse
 import concurrent.futures
 from onedrive_authorization_utils import (
     procure_new_tokens_from_user, load_access_token_from_file, save_access_token,
-    load_refresh_token_from_file, BASE_URL, get_new_access_token_using_refresh_token
+    load_refresh_token_from_file, BASE_URL, get_new_access_token_using_refresh_token, refresh_access_token
 )
 
-import config,utils
+import config,utils,catalog,graph_batch,http_client,concurrency,retry_policy
 
 log = logging.getLogger(__name__)
 
 # Thread-safe lock for shared resources
 lock = threading.Lock()
+# Limit of listing requests in flight during a full scan, see concurrency.py
+listing_limiter = None
 
 
 def get_next_link(response_dict) -> str:
     return response_dict.get("@odata.nextLink")
 
 
+# Only the fields used by the catalog and the downloads are requested, with the largest page size
+LISTING_FIELDS = [
+    "id", "name", "size", "parentReference", "file", "folder", "package",
+    "lastModifiedDateTime", "createdDateTime", "createdBy", "eTag", "cTag",
+    "@microsoft.graph.downloadUrl",
+]
+DELTA_FIELDS = LISTING_FIELDS + ["deleted", "root"]
+
+
+def get_listing_query() -> str:
+    return f"$select={','.join(LISTING_FIELDS)}&$top={config.LISTING_PAGE_SIZE}"
+
+
 def get_folder_endpoint(folder: str) -> str:
     if folder == "/me/drive/root:/" or folder=="/me/drive/root:":
         log.debug("Starting at OneDrive root folder")
-        return f"{BASE_URL}/me/drive/root/children"
-    return f"{BASE_URL}{quote(folder)}:/children"
+        return f"{BASE_URL}/me/drive/root/children?{get_listing_query()}"
+    return f"{BASE_URL}{quote(folder)}:/children?{get_listing_query()}"
 
 
 def format_endpoint(endpoint: str) -> str:
@@ -49,27 +64,45 @@ def format_endpoint(endpoint: str) -> str:
     return endpoint
 
 def fetch_folder_contents(endpoint: str, access_token: str):
-    """Fetch folder contents with automatic endpoint validation and retry logic."""
+    """Fetch folder contents with automatic endpoint validation and retry logic.
+
+    A folder not found is listed as empty, None means the listing failed.
+    """
     endpoint = format_endpoint(endpoint)  # Format the endpoint to avoid 404
-    headers = {"Authorization": f"Bearer {access_token}"}
+    # A folder deleted since it was queued is not retried
+    retry = retry_policy.Retry(f"Listing {endpoint}", {retry_policy.NOT_FOUND: 0})
 
-    if not config.stop_flag:
+    while not config.stop_flag:
+        headers = {"Authorization": f"Bearer {access_token}"}
         try:
-            response = requests.get(endpoint, headers=headers)
+            with listing_limiter.slot():
+                try:
+                    response = http_client.get(endpoint, headers=headers)
+                except requests.exceptions.RequestException:
+                    listing_limiter.record(None)
+                    raise
+                listing_limiter.record(response.status_code, response.elapsed.total_seconds(),
+                                       graph_batch.get_retry_after(response.headers, None))
             response.encoding = "utf-8"
             response.raise_for_status()
             return response.json()      
-        except requests.exceptions.HTTPError as http_err:
-            log.error(f"HTTP Error {http_err}")
-        except requests.exceptions.RequestException as e:
-            log.error(f"Request error: {e}")      
         except Exception as e:
-            log.error(f"Unexpected error: {e}")
+            failure_class, retry_after = retry_policy.classify(e)
+            if failure_class == retry_policy.NOT_FOUND:
+                log.warning(f"{endpoint} not found, deleted since it was queued ?")
+                return {"value": []}
+            if not retry.wait(failure_class, retry_after):
+                log.error(f"Error listing {endpoint}: {e}")
+                break
+            if failure_class == retry_policy.AUTH_EXPIRED:
+                access_token = refresh_access_token(access_token)
     return None
 
 
 
 def process_one_folder(access_token: str):
+    """List one queued folder, return (folder, folders found, files found, number of folders that failed)."""
+    failed = 0
     try:
         folder_list = []
         file_list = []
@@ -79,7 +112,8 @@ def process_one_folder(access_token: str):
         
         while endpoint and not config.stop_flag:
             content = fetch_folder_contents(endpoint, access_token)
-            if not content:
+            if content is None:
+                failed = 0 if config.stop_flag else 1
                 break
             
             for item in content.get("value", []):
@@ -105,31 +139,153 @@ def process_one_folder(access_token: str):
             
     except Exception as exc:
         log.error(f"Error when processing folder: {exc}")
+        failed = 1
         
-        
-    return current_folder, folder_list, file_list
+    return current_folder, folder_list, file_list, failed
 
 
-def process_folders(access_token: str):
-    root_folder = f"/me/drive/root:{config.ONEDRIVEDIR_PATH}"
-    config.folder_queue.put(root_folder)
+def get_batch_url(endpoint: str, encoded: bool = False) -> str:
+    """Relative url of an endpoint for a $batch sub-request.
 
+    Folder endpoints are normalized with format_endpoint and encoded again, nextLinks
+    (encoded=True) are used as returned by Graph.
+    """
+    if not encoded:
+        endpoint = format_endpoint(endpoint)
+        parsed = urlparse(endpoint)
+        endpoint = urlunparse(parsed._replace(path=quote(parsed.path, safe="/:%")))
+    for prefix in (BASE_URL, BASE_URL.rstrip("/")):
+        if endpoint.startswith(prefix):
+            endpoint = endpoint[len(prefix):]
+            break
+    return "/" + endpoint.lstrip("/")
+
+
+def add_folder_content(content, current_folder, folder_list, file_list):
+    for item in content.get("value", []):
+        is_folder = "folder" in item
+        log.info(f"Adding %s from %s {'[FOLDER]' if is_folder else '[FILE]'}",item['name'].encode("utf-8"),current_folder)
+        if is_folder:
+            folder_list.append(item)
+            config.folder_queue.put(item["parentReference"]["path"] + "/" + item["name"])
+        else:
+            file_list.append(item)
+
+
+def record_batch(responses: dict, latency: float):
+    """Report a $batch to the listing limiter, it counts as throttled when one of its sub-requests is."""
+    throttled = [sub_response for sub_response in responses.values() if sub_response.get("status") in (429, 503)]
+    if throttled:
+        retry_after = max(graph_batch.get_retry_after(sub_response.get("headers", {}), 0) for sub_response in throttled)
+        listing_limiter.record(throttled[0]["status"], latency, retry_after)
+    else:
+        listing_limiter.record(200, latency)
+
+
+def process_folder_batch(access_token: str):
+    """List up to MAX_BATCH_SIZE queued folders per Graph $batch request.
+
+    Each folder follows its own nextLink in the next batch. Failed sub-requests are retried
+    in the next batch according to retry_policy, the batch waits for the longest delay.
+    Return (label, folders found, files found, number of folders that failed).
+    """
     folder_list = []
     file_list = []
+    failed = 0
+    pending = []  # [folder, relative url, retry]
+    try:
+        pending.append([config.folder_queue.get(True,3), None, None])
+        while len(pending) < graph_batch.MAX_BATCH_SIZE:
+            pending.append([config.folder_queue.get_nowait(), None, None])
+    except Empty:
+        if not pending:
+            log.warning(f"Queue is empty")
+            return "No more folder to process", folder_list, file_list, failed
+    for one in pending:
+        one[1] = get_batch_url(get_folder_endpoint(one[0]))
+        one[2] = retry_policy.Retry(f"Listing {one[0]}", {retry_policy.NOT_FOUND: 0})
+    label = pending[0][0] if len(pending) == 1 else f"{len(pending)} folders"
+
+    while pending and not config.stop_flag:
+        batch_failure = (retry_policy.TRANSIENT, None)
+        try:
+            with listing_limiter.slot():
+                started = time.monotonic()
+                responses = graph_batch.post_batch([one[1] for one in pending], access_token)
+                record_batch(responses, time.monotonic() - started)
+        except Exception as exc:
+            log.warning(f"Error listing {len(pending)} folders in batch: {exc}")
+            if isinstance(exc, requests.exceptions.HTTPError):
+                listing_limiter.record(exc.response.status_code, None, graph_batch.get_retry_after(exc.response.headers, None))
+            else:
+                listing_limiter.record(None)
+            batch_failure = retry_policy.classify(exc)
+            responses = {}
+        next_pending = []
+        delay = 0
+        auth_expired = False
+        for index, (folder, url, retry) in enumerate(pending):
+            sub_response = responses.get(index)
+            status = sub_response.get("status") if sub_response else None
+            if status == 200:
+                content = sub_response.get("body", {})
+                add_folder_content(content, folder, folder_list, file_list)
+                next_link = get_next_link(content)
+                if next_link:
+                    next_pending.append([folder, get_batch_url(next_link, encoded=True), retry_policy.Retry(f"Listing {folder}", {retry_policy.NOT_FOUND: 0})])
+                continue
+            if sub_response:
+                failure_class = retry_policy.classify_status(status)
+                retry_after = retry_policy.get_retry_after(sub_response.get("headers", {}))
+            else:
+                failure_class, retry_after = batch_failure
+            folder_delay = retry.next_delay(failure_class, retry_after)
+            if failure_class == retry_policy.NOT_FOUND:
+                log.warning(f"{folder} not found, deleted since it was queued ?")
+            elif folder_delay is None:
+                log.error(f"Error {status} listing folder {folder}")
+                failed += 1
+            else:
+                delay = max(delay, folder_delay)
+                auth_expired = auth_expired or failure_class == retry_policy.AUTH_EXPIRED
+                next_pending.append([folder, url, retry])
+        if delay:
+            log.warning(f"Listing of {len(next_pending)} folders failed, retrying in {delay:.1f}s")
+            retry_policy.sleep(delay)
+        if auth_expired:
+            access_token = refresh_access_token(access_token)
+        pending = next_pending
+
+    return label, folder_list, file_list, failed
+
+
+def process_folders(access_token: str, scan):
+    """Walk the tree from the root folder, saving items to the catalog scan as folders are listed."""
+    root_folder = f"/me/drive/root:{config.ONEDRIVEDIR_PATH}"
+    config.folder_queue.put(root_folder)
 
     log.debug(f"Starting from root folder: {root_folder}")
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=config.MAX_WORKERS_GEN) as executor:
+    global listing_limiter
+    listing_limiter = concurrency.create("Listing", config.MAX_WORKERS_GEN, config.MAX_WORKERS_GEN_LIMIT)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=listing_limiter.maximum) as executor:
         futures = set()
 
         while (not config.folder_queue.empty() or futures) and not config.stop_flag:
             
             log.debug(f"Queue length %s",config.folder_queue.qsize())
             # Submit new folder tasks while workers are available
-            while len(futures) < config.MAX_WORKERS_GEN and not config.folder_queue.empty() and not config.stop_flag:
+            if config.USE_BATCH_LISTING:
+                # Each task takes up to MAX_BATCH_SIZE folders from the queue
+                max_tasks = min(listing_limiter.current, len(futures) + -(-config.folder_queue.qsize() // graph_batch.MAX_BATCH_SIZE))
+                worker = process_folder_batch
+            else:
+                max_tasks = listing_limiter.current
+                worker = process_one_folder
+            while len(futures) < max_tasks and not config.folder_queue.empty() and not config.stop_flag:
                 try:
                     log.debug(f"Submit new executor,len(futures) %s",len(futures))
-                    future = executor.submit(process_one_folder, access_token)
+                    future = executor.submit(worker, access_token)
                     futures.add(future)  # Track running futures
                 except TimeoutError:
                     log.error('Time out submitting')
@@ -139,10 +295,11 @@ def process_folders(access_token: str):
 
                 for future in done:
                     with lock:
-                        current_folder, new_folders, new_files = future.result()
-                        folder_list.extend(new_folders)
-                        file_list.extend(new_files)
-                        config.status_str = f"Identifying files: \n{len(file_list)} files found so far,\n{config.folder_queue.qsize()} folders remaining to be scanned"
+                        current_folder, new_folders, new_files, failed = future.result()
+                        scan.extend(new_folders)
+                        scan.extend(new_files)
+                        scan.failed_folders += failed
+                        config.status_str = f"Identifying files: \n{scan.files} files found so far,\n{config.folder_queue.qsize()} folders remaining to be scanned"
                         log.debug(f"Processed folder: {current_folder}")
                           
                 # Remove completed future
@@ -155,72 +312,271 @@ def process_folders(access_token: str):
         # Final cleanup
         executor.shutdown(wait=True)
 
-    config.status_str = f"Identification complete: {len(file_list)} files found."
+    listing_limiter.log_summary()
+    config.status_str = f"Identification complete: {scan.files} files found."
     config.isprocessing=False
     config.progress_num=0
-    return file_list, folder_list
+    return scan.files, scan.folders
+
+
+
+def run_folder_walk(access_token: str, scan):
+    """Full walk with the engine set in config.ENUM_ENGINE: "async" (asyncio) or "thread" (ThreadPoolExecutor)."""
+    if config.ENUM_ENGINE == "async":
+        try:
+            import generate_list_async
+        except ImportError as e:
+            log.warning(f"asyncio engine not available ({e}), using thread engine")
+        else:
+            return generate_list_async.process_folders(access_token, scan)
+    return process_folders(access_token, scan)
+
+
+class DeltaResyncRequired(Exception):
+    """The saved delta state cannot be used, a full walk of the tree is needed."""
+
+
+def get_delta_endpoint(folder: str) -> str:
+    query = f"$select={','.join(DELTA_FIELDS)}"
+    if folder == "/" or not folder:
+        return f"{BASE_URL}me/drive/root/delta?{query}"
+    return f"{BASE_URL}me/drive/root:{quote(folder.rstrip('/'))}:/delta?{query}"
+
+
+def get_scope_endpoint(folder: str) -> str:
+    if folder == "/" or not folder:
+        return f"{BASE_URL}me/drive/root"
+    return f"{BASE_URL}me/drive/root:{quote(folder.rstrip('/'))}"
+
+
+def load_delta_token():
+    """Return the saved deltaLink if it was produced for the current OneDrive root folder."""
+    try:
+        root = catalog.get_state("root")
+        delta_link = catalog.get_state("deltaLink")
+    except Exception as e:
+        log.warning(f"Error loading delta token: {e}")
+        return None
+    if not delta_link:
+        log.info("No delta token saved yet")
+        return None
+    if root != config.ONEDRIVEDIR_PATH:
+        log.info(f"Delta token was saved for {root}, not for {config.ONEDRIVEDIR_PATH}")
+        return None
+    return delta_link
+
 
+def clear_delta_token():
+    try:
+        with catalog.transaction():
+            catalog.set_state("deltaLink", None)
+    except Exception as e:
+        log.error(f"Error removing delta token: {e}")
+
+
+def fetch_delta_page(endpoint: str, access_token: str):
+    """Fetch one page of delta results. deltaLink/nextLink are used as returned by Graph, without reformatting."""
+    retry = retry_policy.Retry("Delta listing", {retry_policy.NOT_FOUND: 0})
+    while True:
+        headers = {"Authorization": f"Bearer {access_token}"}
+        try:
+            response = http_client.get(endpoint, headers=headers, timeout=config.TIMEOUT)
+            if response.status_code == 410:
+                # resyncRequired: the token is too old or the server state was reset
+                raise DeltaResyncRequired(f"Delta token expired ({response.status_code})")
+            response.encoding = "utf-8"
+            response.raise_for_status()
+            return response.json()
+        except DeltaResyncRequired:
+            raise
+        except Exception as e:
+            failure_class, retry_after = retry_policy.classify(e)
+            if not retry.wait(failure_class, retry_after):
+                raise
+            if failure_class == retry_policy.AUTH_EXPIRED:
+                access_token = refresh_access_token(access_token)
+
+
+def fetch_latest_delta_link(access_token: str):
+    """Get a deltaLink pointing at the current state of the drive, without enumerating it."""
+    try:
+        content = fetch_delta_page(get_delta_endpoint(config.ONEDRIVEDIR_PATH) + "&token=latest", access_token)
+        return content.get("@odata.deltaLink")
+    except Exception as e:
+        log.error(f"Error getting latest delta token: {e}")
+    return None
+
+
+def folder_path_resolver(folders: dict, scope_id: str, scope_path: str):
+    """Return a function giving the path of a folder from its id, rebuilt from the parent ids.
+
+    folders maps each folder id to (parent_id, name).
+    Delta items do not carry parentReference.path, and renaming or moving a folder does not
+    return its descendants, so paths are always recomputed from the id chain.
+    The function returns None when the chain does not lead to the scope folder (deleted parents).
+    """
+    folder_paths = {scope_id: scope_path}
+
+    def path_of(folder_id):
+        chain = []
+        while folder_id not in folder_paths:
+            if folder_id not in folders or folder_id in chain:
+                return None
+            chain.append(folder_id)
+            folder_id = folders[folder_id][0]
+        path = folder_paths[folder_id]
+        for one_id in reversed(chain):
+            path = f"{path}/{folders[one_id][1]}"
+            folder_paths[one_id] = path
+        return path
+
+    return path_of
+
+
+def process_delta(access_token: str, delta_link: str):
+    """Apply the changes since the saved delta token to the catalog.
+
+    Changes and the new token are committed in one transaction, an interrupted
+    run leaves the catalog and the token of the previous run untouched.
+    """
+    if catalog.count_files() == 0:
+        raise DeltaResyncRequired("Catalog is empty")
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = http_client.get(get_scope_endpoint(config.ONEDRIVEDIR_PATH), headers=headers, timeout=config.TIMEOUT)
+    response.raise_for_status()
+    scope = response.json()
+    scope_id = scope["id"]
+    if "root" in scope:
+        scope_path = "/drive/root:"
+    else:
+        scope_path = f"{scope['parentReference']['path']}/{scope['name']}"
+
+    changes = {}
+    endpoint = delta_link
+    new_delta_link = None
+    while endpoint and not config.stop_flag:
+        content = fetch_delta_page(endpoint, access_token)
+        for item in content.get("value", []):
+            if item["id"] != scope_id:
+                changes[item["id"]] = item
+        config.status_str = f"Identifying changes: \n{len(changes)} changes found so far"
+        endpoint = get_next_link(content)
+        new_delta_link = content.get("@odata.deltaLink")
+
+    if config.stop_flag or not new_delta_link:
+        return None
+
+    deleted = [item_id for item_id, item in changes.items() if "deleted" in item]
+    updated = [item for item in changes.values() if "deleted" not in item]
+    for item in updated:
+        log.info(f"Updating %s {'[FOLDER]' if 'folder' in item else '[FILE]'}", item.get("name", "").encode("utf-8"))
+    log.info(f"Removing {len(deleted)} deleted items")
+
+    with catalog.transaction():
+        catalog.delete_items(deleted)
+        catalog.upsert_items(updated)
+        folders = catalog.load_folders()
+        path_of = folder_path_resolver(folders, scope_id, scope_path)
+        parent_paths = [(scope_id, scope_path)]
+        orphans = []
+        for folder_id in folders:
+            path = path_of(folder_id)
+            if path is None:
+                orphans.append(folder_id)
+            else:
+                parent_paths.append((folder_id, path))
+        catalog.delete_items(orphans)
+        catalog.set_parent_paths(parent_paths)
+        removed = catalog.delete_orphans(scope_id)
+        catalog.set_state("root", config.ONEDRIVEDIR_PATH)
+        catalog.set_state("deltaLink", new_delta_link)
+
+    log.info(f"{len(changes)} changes applied from delta, {len(orphans) + removed} orphan items removed")
+    return catalog.count_files(), catalog.count_folders()
 
 
 def generate_list_of_all_files_and_folders(access_token):
     
-    
-    file_list, folder_list = process_folders(access_token)
-    
-    log.info("Saving files")
-    with open("file_list.json", "w", encoding="utf-8") as f:
-        json.dump(file_list, f, indent=2)
-    
-    with open("folder_list.json", "w", encoding="utf-8") as f:
-        json.dump(folder_list, f, indent=2)
+    file_count = None
+    retry_policy.reset_stats()
+    if config.USE_DELTA:
+        delta_link = load_delta_token()
+        try:
+            if not delta_link:
+                raise DeltaResyncRequired("No delta token")
+            config.status_str = "Identifying changes since last run"
+            result = process_delta(access_token, delta_link)
+            if result is None:
+                log.error("Incremental listing did not complete, previous catalog kept")
+                config.status_str = "Identification stopped before completion."
+                config.isprocessing = False
+                return
+            file_count, folder_count = result
+            config.isprocessing = False
+        except DeltaResyncRequired as e:
+            log.warning(f"{e}, full scan needed")
+        except Exception as e:
+            log.error(f"Error during incremental listing: {e}")
+            log.error("Traceback: %s", traceback.format_exc())
+            config.status_str = "Identification failed, previous catalog kept."
+            config.isprocessing = False
+            return
+
+    if file_count is None:
+        # The catalog is only a valid base for the next delta once the walk completes
+        clear_delta_token()
+        # Take the token before walking, so changes made during the walk are seen next time
+        delta_link = fetch_latest_delta_link(access_token) if config.USE_DELTA else None
+        scan = catalog.Scan()
+        run_folder_walk(access_token, scan)
+        if scan.failed_folders and not config.stop_flag:
+            # Items of the folders not listed would be removed, and a delta run would not list them again
+            log.error(f"{scan.failed_folders} folders could not be listed, previous catalog items kept and no delta token saved")
+        elif not config.stop_flag:
+            scan.complete(config.ONEDRIVEDIR_PATH, delta_link)
+        file_count, folder_count = scan.files, scan.folders
     
     config.progress_num=0
-    log.info("File and folder lists have been saved.")
-    log.info(f"Total Files: {len(file_list)}, Total Folders: {len(folder_list)}")
-    config.status_str = f"Identification complete: {len(file_list)} files found."
+    log.info("Catalog has been saved.")
+    log.info(f"Total Files: {file_count}, Total Folders: {folder_count}")
+    http_client.log_stats()
+    retry_policy.log_stats()
+    config.status_str = f"Identification complete: {file_count} files found."
     config.progress_num=0
     log.info("Done.")
 
     
-def find_folder_and_file_from_url(url):
+def find_folder_and_file_from_url(url, fileid=None):
+    """Find the folder endpoint, name and id of an item, by id (primary key) when known, else by download URL (indexed)."""
     try:
-        for item in config.file_list:
-            if item.get('@microsoft.graph.downloadUrl')==url:
-                folder="/me"+item["parentReference"]["path"]
-                file=item["name"]
-                return get_folder_endpoint(folder),file,item["id"]
+        if fileid:
+            item = catalog.find_item_by_id(fileid)
+        else:
+            item = catalog.find_item_by_url(url)
+        if item:
+            folder="/me"+item["parentReference"]["path"]
+            file=item["name"]
+            return get_folder_endpoint(folder),file,item["id"]
     except Exception as exc:
         log.error(f"Error finding endpoint: {exc}")
     return None,None,None
     
-def refresh_download_url(url):
+def refresh_download_url(url, fileid=None):
+    """Get a new download URL for an item, through a single GET of the item (see graph_batch)."""
     access_token = config.accesstoken
-    endpoint,file,fileid = find_folder_and_file_from_url(url)
-    log.debug(f"{url} is file {file} ({fileid}) in folder {endpoint}")
-    good_url=""
+    if not fileid:
+        endpoint,file,fileid = find_folder_and_file_from_url(url)
+        log.debug(f"{url} is file {file} ({fileid}) in folder {endpoint}")
+    if not fileid or not access_token:
+        log.error(f"Error searching {url}: file id {fileid}")
+        return None
     try:
-        if not endpoint or not url or not access_token:
-            log.error(f"Error searching {url}: file {file} ({fileid}) in folder {endpoint}")
-            return None
-            
-        while endpoint and not good_url:
-            content=fetch_folder_contents(endpoint,access_token)
-            
-            if not content:
-                log.error(f"Error fetching content for {url}: file {file} ({fileid}) in folder {endpoint}")
-                return None
-            for item in content.get("value", []):
-                if item["id"]==fileid:
-                    good_url=item.get('@microsoft.graph.downloadUrl')         
-                    break
-            endpoint = get_next_link(content)
-            
-        log.debug(f"Item name %s (%s) - %s",item["name"],item["id"],good_url)
-        if "http" in good_url:
+        good_url = graph_batch.fetch_download_urls([fileid], access_token).get(fileid)
+        log.debug(f"Item %s - %s",fileid,good_url)
+        if good_url and "http" in good_url:
             return good_url
-        else:
-            return None
     except Exception as exc:
         log.error(f"Error refreshing download url: {exc}")
         log.error("Traceback: %s", traceback.format_exc())
-    return None
\ No newline at end of file
+    return None
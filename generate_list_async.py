@@ -0,0 +1,218 @@
+import asyncio
+import logging,traceback
+
+import aiohttp
+
+from generate_list import get_folder_endpoint, format_endpoint, get_next_link, get_batch_url
+from onedrive_authorization_utils import refresh_access_token
+import config,graph_batch,http_client,concurrency,retry_policy
+
+log = logging.getLogger(__name__)
+
+# asyncio enumeration engine: every folder listing is a task on one event loop,
+# the requests in flight are limited by an adaptive limiter, up to ASYNC_LISTING_CONCURRENCY.
+# The walk ends when the last listing task ends, there is no queue to poll.
+FLUSH_SIZE = 1000
+BATCH_DELAY = 0.01  # Seconds to wait for more listings before sending an incomplete $batch
+
+
+class BatchGateway:
+    """Group the page requests of the listing tasks into $batch requests of up to MAX_BATCH_SIZE."""
+
+    def __init__(self, session, limiter):
+        self.session = session
+        self.limiter = limiter
+        self.pending = []
+        self.flush_handle = None
+        self.senders = set()
+
+    async def get(self, url: str):
+        """Return (status, headers, body) of the sub-response for a relative url."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((url, future))
+        if len(self.pending) >= graph_batch.MAX_BATCH_SIZE:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(BATCH_DELAY, self.flush)
+        return await future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        while self.pending:
+            batch = self.pending[:graph_batch.MAX_BATCH_SIZE]
+            self.pending = self.pending[graph_batch.MAX_BATCH_SIZE:]
+            sender = asyncio.create_task(self.send(batch))
+            self.senders.add(sender)
+            sender.add_done_callback(self.senders.discard)
+
+    async def send(self, batch):
+        payload = {"requests": [{"id": str(index), "method": "GET", "url": url} for index, (url, future) in enumerate(batch)]}
+        try:
+            async with self.limiter.slot_async():
+                started = asyncio.get_running_loop().time()
+                try:
+                    async with self.session.post(graph_batch.get_batch_endpoint(), json=payload) as response:
+                        if response.status in (429, 503):
+                            # The whole batch is throttled, each page request sees it
+                            self.limiter.record(response.status, None, graph_batch.get_retry_after(response.headers, None))
+                            data = {"responses": [{"id": str(index), "status": response.status, "headers": dict(response.headers)} for index in range(len(batch))]}
+                        else:
+                            response.raise_for_status()
+                            data = await response.json(encoding="utf-8")
+                            self.record(data, asyncio.get_running_loop().time() - started)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    self.limiter.record(None)
+                    raise
+        except Exception as e:
+            for url, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        responses = {int(sub_response["id"]): sub_response for sub_response in data.get("responses", [])}
+        for index, (url, future) in enumerate(batch):
+            sub_response = responses.get(index)
+            if future.done():
+                continue
+            if sub_response is None:
+                future.set_exception(aiohttp.ClientError(f"No response for {url} in batch"))
+            else:
+                future.set_result((sub_response.get("status"), sub_response.get("headers", {}), sub_response.get("body", {})))
+
+
+    def record(self, data, latency):
+        """Report a $batch to the limiter, it counts as throttled when one of its sub-requests is."""
+        throttled = [sub_response for sub_response in data.get("responses", []) if sub_response.get("status") in (429, 503)]
+        if throttled:
+            retry_after = max(graph_batch.get_retry_after(sub_response.get("headers", {}), 0) for sub_response in throttled)
+            self.limiter.record(throttled[0]["status"], latency, retry_after)
+        else:
+            self.limiter.record(200, latency)
+
+
+class AsyncFolderWalker:
+
+    def __init__(self, access_token: str, scan):
+        self.access_token = access_token
+        self.scan = scan
+        self.items = []
+        self.started = 0
+        self.done = 0
+        self.failed = 0
+        self.session = None
+        self.limiter = None
+        self.gateway = None
+        self.tasks = None
+
+    async def get(self, endpoint: str, is_next_link: bool):
+        """Return (status, headers, body) for an endpoint, body is only read for successful requests."""
+        if self.gateway:
+            return await self.gateway.get(get_batch_url(endpoint, encoded=is_next_link))
+        async with self.limiter.slot_async():
+            started = asyncio.get_running_loop().time()
+            try:
+                async with self.session.get(format_endpoint(endpoint)) as response:
+                    self.limiter.record(response.status, asyncio.get_running_loop().time() - started,
+                                        graph_batch.get_retry_after(response.headers, None))
+                    if response.status == 200:
+                        return response.status, response.headers, await response.json(encoding="utf-8")
+                    return response.status, response.headers, None
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.limiter.record(None)
+                raise
+
+    async def fetch_json(self, endpoint: str, is_next_link: bool):
+        """GET a listing page, failed requests are retried according to retry_policy.
+
+        A folder not found is listed as empty, None means the listing failed.
+        """
+        # A folder deleted since it was found is not retried
+        retry = retry_policy.Retry(f"Listing {endpoint}", {retry_policy.NOT_FOUND: 0})
+        while not config.stop_flag:
+            access_token = self.access_token
+            try:
+                status, headers, body = await self.get(endpoint, is_next_link)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                failure_class, retry_after = retry_policy.classify(e)
+            else:
+                if status == 200:
+                    return body
+                failure_class, retry_after = retry_policy.classify_status(status), retry_policy.get_retry_after(headers)
+            if failure_class == retry_policy.NOT_FOUND:
+                log.warning(f"{endpoint} not found, deleted since it was queued ?")
+                return {"value": []}
+            if not await retry.wait_async(failure_class, retry_after):
+                return None
+            if failure_class == retry_policy.AUTH_EXPIRED:
+                await self.refresh_token(access_token)
+        return None
+
+    async def refresh_token(self, expired_token: str):
+        if self.access_token != expired_token:
+            return  # Already renewed by another listing
+        self.access_token = await asyncio.to_thread(refresh_access_token, expired_token)
+        self.session.headers["Authorization"] = f"Bearer {self.access_token}"
+
+    async def list_folder(self, folder: str):
+        try:
+            endpoint = get_folder_endpoint(folder)
+            is_next_link = False
+            log.debug(f"Processing folder: {folder}")
+            while endpoint and not config.stop_flag:
+                content = await self.fetch_json(endpoint, is_next_link)
+                if content is None:
+                    if not config.stop_flag:
+                        self.failed += 1
+                    break
+                for item in content.get("value", []):
+                    is_folder = "folder" in item
+                    log.info(f"Adding %s from %s {'[FOLDER]' if is_folder else '[FILE]'}",item['name'].encode("utf-8"),folder)
+                    if is_folder:
+                        self.start(item["parentReference"]["path"] + "/" + item["name"])
+                    self.items.append(item)
+                endpoint = get_next_link(content)
+                is_next_link = True
+        except Exception as exc:
+            log.error(f"Error when processing folder {folder}: {exc}")
+            log.error("Traceback: %s", traceback.format_exc())
+            self.failed += 1
+        finally:
+            self.done += 1
+            if len(self.items) >= FLUSH_SIZE:
+                self.flush()
+            config.status_str = f"Identifying files: \n{self.scan.files + len(self.items)} files found so far,\n{self.started - self.done} folders remaining to be scanned"
+
+    def start(self, folder: str):
+        self.started += 1
+        self.tasks.create_task(self.list_folder(folder))
+
+    def flush(self):
+        items, self.items = self.items, []
+        self.scan.extend(items)
+
+    async def run(self):
+        headers = dict(http_client.DEFAULT_HEADERS)
+        headers["Authorization"] = f"Bearer {self.access_token}"
+        self.limiter = concurrency.create("Listing", config.MAX_WORKERS_GEN, config.ASYNC_LISTING_CONCURRENCY)
+        connector = aiohttp.TCPConnector(limit=self.limiter.maximum)
+        timeout = aiohttp.ClientTimeout(sock_connect=config.TIMEOUT, sock_read=config.TIMEOUT)
+        async with aiohttp.ClientSession(headers=headers, connector=connector, timeout=timeout) as self.session:
+            if config.USE_BATCH_LISTING:
+                self.gateway = BatchGateway(self.session, self.limiter)
+            async with asyncio.TaskGroup() as self.tasks:
+                self.start(f"/me/drive/root:{config.ONEDRIVEDIR_PATH}")
+        self.flush()
+        self.limiter.log_summary()
+
+
+def process_folders(access_token: str, scan):
+    """Walk the tree from the root folder with asyncio, saving items to the catalog scan as folders are listed."""
+    walker = AsyncFolderWalker(access_token, scan)
+    asyncio.run(walker.run())
+    scan.failed_folders += walker.failed
+    log.info(f"{walker.done} folders listed, {walker.failed} failed")
+    config.status_str = f"Identification complete: {scan.files} files found."
+    config.isprocessing=False
+    config.progress_num=0
+    return scan.files, scan.folders
@@ -0,0 +1,143 @@
+import time
+import logging,traceback
+import threading
+
+from onedrive_authorization_utils import BASE_URL,refresh_access_token
+
+import config,utils,catalog,http_client,retry_policy
+
+log = logging.getLogger(__name__)
+
+# JSON batching: up to 20 Graph requests in one HTTP round trip
+# https://learn.microsoft.com/en-us/graph/json-batching
+MAX_BATCH_SIZE = 20
+DOWNLOAD_URL_FETCHED = catalog.DOWNLOAD_URL_FETCHED
+
+
+def get_batch_endpoint() -> str:
+    return f"{BASE_URL}$batch"
+
+
+def get_retry_after(headers, default) -> int:
+    """Seconds to wait from a Retry-After header, default when missing or not a number of seconds."""
+    retry_after = retry_policy.get_retry_after(headers)
+    return default if retry_after is None else retry_after
+
+
+def post_batch(sub_requests: list, access_token: str) -> dict:
+    """Send up to MAX_BATCH_SIZE GET requests (list of relative urls) and return {index: response}.
+
+    Each response is the Graph sub-response dict (status, headers, body), the index is the
+    position of the url in sub_requests. Sub-requests missing from the answer are not returned.
+    """
+    headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+    payload = {"requests": [{"id": str(index), "method": "GET", "url": url} for index, url in enumerate(sub_requests)]}
+    response = http_client.post(get_batch_endpoint(), headers=headers, json=payload, timeout=config.TIMEOUT)
+    response.raise_for_status()
+    responses = {}
+    for sub_response in response.json().get("responses", []):
+        responses[int(sub_response["id"])] = sub_response
+    return responses
+
+
+def fetch_download_urls(item_ids: list, access_token: str) -> dict:
+    """Get fresh download URLs for items, MAX_BATCH_SIZE items per request.
+
+    Returns {id: url}, url is None for items that no longer exist (404).
+    Items that failed (throttling, other errors) are not in the result and can be retried later.
+    """
+    urls = {}
+    for start in range(0, len(item_ids), MAX_BATCH_SIZE):
+        chunk = item_ids[start:start + MAX_BATCH_SIZE]
+        sub_requests = [f"/me/drive/items/{item_id}?$select=id,@microsoft.graph.downloadUrl" for item_id in chunk]
+        responses = None
+        retry = retry_policy.Retry("Download urls refresh", {retry_policy.NOT_FOUND: 0})
+        while responses is None:
+            try:
+                responses = post_batch(sub_requests, access_token)
+            except Exception as e:
+                failure_class, retry_after = retry_policy.classify(e)
+                if not retry.wait(failure_class, retry_after):
+                    log.error(f"Error refreshing download urls: {e}")
+                    break
+                if failure_class == retry_policy.AUTH_EXPIRED:
+                    access_token = refresh_access_token(access_token)
+        if responses is None:
+            continue
+        for index, item_id in enumerate(chunk):
+            sub_response = responses.get(index)
+            if not sub_response:
+                continue
+            status = sub_response.get("status")
+            if status == 200:
+                urls[item_id] = sub_response.get("body", {}).get("@microsoft.graph.downloadUrl")
+            elif status == 404:
+                urls[item_id] = None
+            else:
+                log.warning(f"Error {status} refreshing download url of {item_id}")
+    refreshed = [(url, item_id) for item_id, url in urls.items() if url]
+    if refreshed:
+        catalog.set_download_urls(refreshed)
+    return urls
+
+
+def is_download_url_expiring(item, margin=None) -> bool:
+    """True when the download URL of the item is missing or will expire within margin seconds."""
+    if margin is None:
+        margin = config.DOWNLOAD_URL_MARGIN
+    fetched = item.get(DOWNLOAD_URL_FETCHED)
+    if not item.get("@microsoft.graph.downloadUrl") or not fetched:
+        return True
+    return time.time() + margin >= fetched + config.DOWNLOAD_URL_TTL
+
+
+class DownloadUrlRefresher:
+    """Keep the download URLs of queued items fresh.
+
+    Items are registered when they are queued for download and removed when their
+    download starts. Every interval, URLs that expire soon are refreshed through
+    $batch and updated in place in the queued item dicts and in the catalog.
+    At most max_per_cycle items are refreshed per interval, first queued first.
+    """
+
+    def __init__(self, interval=60, max_per_cycle=400):
+        self.lock = threading.Lock()
+        self.queued = {}
+        self.max_per_cycle = max_per_cycle
+        self.timer = utils.RepeatedTimer(interval, self.refresh_expiring)
+
+    def add(self, item):
+        with self.lock:
+            self.queued[item["id"]] = item
+
+    def discard(self, item):
+        with self.lock:
+            self.queued.pop(item["id"], None)
+
+    def refresh_expiring(self):
+        try:
+            expiring = []
+            with self.lock:
+                for item in self.queued.values():
+                    if is_download_url_expiring(item):
+                        expiring.append(item)
+                        if len(expiring) >= self.max_per_cycle:
+                            break
+            if not expiring or not config.accesstoken:
+                return
+            log.info(f"Refreshing {len(expiring)} download urls before expiry")
+            urls = fetch_download_urls([item["id"] for item in expiring], config.accesstoken)
+            now = time.time()
+            for item in expiring:
+                if item["id"] in urls:
+                    item["@microsoft.graph.downloadUrl"] = urls[item["id"]]
+                    item[DOWNLOAD_URL_FETCHED] = now
+                    if not urls[item["id"]]:
+                        # Deleted since the listing, the download will report it
+                        self.discard(item)
+        except Exception as e:
+            log.error(f"Error refreshing download urls: {e}")
+            log.error("Traceback: %s", traceback.format_exc())
+
+    def stop(self):
+        self.timer.stop()
@@ -0,0 +1,78 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+log = logging.getLogger(__name__)
+
+# One requests.Session for the whole process: connections to Graph and to the
+# download hosts are kept alive and reused by all enumeration and download workers.
+# Its pool is sized once, for the most workers the limiters allow (config.HTTP_POOL_SIZE).
+DEFAULT_HEADERS = {
+    "User-Agent": "OneDriveOfflineBackup",
+    "Accept-Encoding": "gzip, deflate",
+}
+
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"requests": 0}
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session(config.HTTP_POOL_SIZE)
+    return _session
+
+
+def create_session(pool_size) -> requests.Session:
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    # pool_connections is the number of hosts kept, pool_maxsize the connections kept per host
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    log.debug(f"HTTP session created with {pool_size} connections per host")
+    return session
+
+
+def request(method, url, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", config.TIMEOUT)
+    with _stats_lock:
+        _stats["requests"] += 1
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def _iter_pools(session):
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                yield pool
+
+
+def get_stats() -> dict:
+    """Requests sent, connections opened and requests that reused an open connection."""
+    connections = sum(pool.num_connections for pool in _iter_pools(_session)) if _session is not None else 0
+    requests_sent = _stats["requests"]
+    return {"requests": requests_sent, "connections": connections, "reused": max(requests_sent - connections, 0)}
+
+
+def log_stats():
+    stats = get_stats()
+    log.info(f"HTTP: {stats['requests']} requests, {stats['connections']} connections opened, {stats['reused']} reused")
@@ -0,0 +1,109 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import config
+
+log = logging.getLogger(__name__)
+
+# Files and directories of the backup folder, listed once at the start of a run.
+# Directories are scanned in parallel, which hides the latency of network shares.
+# Existence, size and date checks are then answered from memory, and a directory
+# is only created (one mkdir) when it is not in the index.
+
+
+class FileStat:
+    """The stat fields used to compare local files, lighter than os.stat_result for big trees."""
+
+    __slots__ = ("st_size", "st_mtime_ns", "st_dev", "st_ino")
+
+    def __init__(self, stat):
+        self.st_size = stat.st_size
+        self.st_mtime_ns = stat.st_mtime_ns
+        self.st_dev = stat.st_dev
+        self.st_ino = stat.st_ino  # 0 when listed on Windows, see file_hashes.is_same_content
+
+    @property
+    def st_mtime(self) -> float:
+        return self.st_mtime_ns / 1e9
+
+
+def get_key(path) -> str:
+    return os.path.normcase(os.path.normpath(path))
+
+
+def scan_directory(path):
+    """Return ([(path, FileStat)], [sub directory paths]) of one directory."""
+    files, directories = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    elif entry.is_file():
+                        files.append((entry.path, FileStat(entry.stat())))
+                except OSError as e:
+                    log.warning(f"Cannot read {entry.path.encode('utf-8')}: {e}")
+    except OSError as e:
+        log.warning(f"Cannot list {path.encode('utf-8')}: {e}")
+    return files, directories
+
+
+class LocalIndex:
+
+    def __init__(self, root: str):
+        self.root = root
+        self.files = {}  # key: FileStat
+        self.directories = set()  # keys
+
+    def build(self):
+        started = time.monotonic()
+        if not os.path.isdir(self.root):
+            return self
+        self.directories.add(get_key(self.root))
+        with ThreadPoolExecutor(max_workers=config.LOCAL_SCAN_WORKERS) as executor:
+            pending = {executor.submit(scan_directory, self.root)}
+            while pending and not config.stop_flag:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, directories = future.result()
+                    for path, stat in files:
+                        self.files[get_key(path)] = stat
+                    for path in directories:
+                        self.directories.add(get_key(path))
+                        pending.add(executor.submit(scan_directory, path))
+            for future in pending:
+                future.cancel()
+        log.info(f"Local index: {len(self.files)} files in {len(self.directories)} directories, listed in {time.monotonic() - started:.1f}s")
+        return self
+
+    def stat(self, path):
+        """FileStat of a file, None when it does not exist."""
+        return self.files.get(get_key(path))
+
+    def makedirs(self, path):
+        """Create a directory and its missing parents, the directories in the index are not checked again."""
+        key = get_key(path)
+        if key in self.directories:
+            return
+        path = os.path.normpath(path)
+        parent = os.path.dirname(path)
+        if parent and parent != path:
+            self.makedirs(parent)
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            if not os.path.isdir(path):
+                raise
+        self.directories.add(key)
+
+    def move(self, source, target):
+        """Follow a file moved by the run, its stat is the same under its new path."""
+        stat = self.files.pop(get_key(source), None)
+        if stat is not None:
+            self.files[get_key(target)] = stat
+
+    def remove(self, path):
+        self.files.pop(get_key(path), None)
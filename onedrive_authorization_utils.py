@@ -1,11 +1,11 @@
 import msal
 import webbrowser
-import requests 
 import json
 import os 
 import logging
 import threading
 import config
+import http_client
 
 log = logging.getLogger(__name__)
 
@@ -24,6 +24,7 @@ APP_CODE=os.environ.get("MS_OPENGRAPH_APP_CODE")
 SCOPES=["Files.ReadWrite.All"]
 
 lock_token = threading.Lock()
+lock_refresh = threading.Lock()
 
 # This will expire in 24 months -- i.e., January 2, 2025.
 # You can generate a new one in Azure Portal under app registrations > client secrets
@@ -120,11 +121,26 @@ def get_new_access_token_using_refresh_token(refresh_token:str):
         "refresh_token": refresh_token,
     }
 
-    response = requests.post(url=request_url, headers=headers, data=payload)
+    response = http_client.post(url=request_url, headers=headers, data=payload)
     log.debug(response.content)
     responseText = response.text
     log.debug(responseText)
     j = json.loads(responseText)
 
-    return j["access_token"] 
-    
+    return j["access_token"]
+
+
+def refresh_access_token(expired_token: str) -> str:
+    """Get a new access token after a 401, workers seeing the same expired token share one refresh."""
+    with lock_refresh:
+        if config.accesstoken and config.accesstoken != expired_token:
+            return config.accesstoken
+        refresh_token = load_refresh_token_from_file()
+        if not refresh_token:
+            log.error("No refresh token to renew the access token")
+            return expired_token
+        access_token = get_new_access_token_using_refresh_token(refresh_token)
+        save_access_token(access_token)
+        config.accesstoken = access_token
+        log.info("Access token renewed")
+        return access_token
@@ -0,0 +1,128 @@
+import os
+import logging
+import threading
+
+import catalog
+import local_index
+
+log = logging.getLogger(__name__)
+
+# Items keep their id when they are moved or renamed on OneDrive. The catalog records,
+# for each item, the local path of the file written for it (relative to the backup
+# folder). When an item is not found at its new path, the file at its recorded path is
+# checked like a local copy (size, date or hash) and renamed to the new path instead of
+# being downloaded again. A file that cannot be moved is downloaded. The copies left at
+# old paths are removed at the end of the run, once every item has recorded its file and
+# the files replacing them are in place, unless another item has its file there now.
+# The directories emptied are removed then.
+MOVED = "moved"  # Outcome of process_item, next to the ones of dedup.py
+
+
+class Relocator:
+
+    def __init__(self, root: str, local_files=None):
+        self.root = root
+        self.local_files = local_files
+        self.lock = threading.Lock()
+        self.claimed = set()  # Keys of the paths items of this run have their file at
+        self.previous_copies = []  # (path, item id, new path) of the files replaced by a file at a new path
+        self.emptied = set()  # Directories files were moved or removed from
+        self.moved = 0
+        self.bytes_saved = 0
+        self.removed = 0
+        self.pruned = 0
+
+    def get_relative_path(self, local_file_path) -> str:
+        return os.path.relpath(local_file_path, self.root)
+
+    def get_previous_path(self, item, local_file_path):
+        """Path of the file written for the item by a previous run, None when unknown or when it is local_file_path."""
+        previous = item.get(catalog.LOCAL_PATH)
+        if not previous:
+            return None
+        previous = os.path.join(self.root, previous)
+        if local_index.get_key(previous) == local_index.get_key(local_file_path):
+            return None
+        return previous
+
+    def move(self, item, source, target) -> bool:
+        """Rename the file of the item from its previous path to target, False when it failed."""
+        # One move at a time: when names are swapped on OneDrive, the file another item
+        # found its file at or moved into is not taken from it
+        with self.lock:
+            if local_index.get_key(source) in self.claimed or catalog.is_local_path_used(self.get_relative_path(source), item["id"]):
+                return False
+            try:
+                os.replace(source, target)
+            except OSError as e:
+                log.warning(f"Cannot move {source.encode('utf-8')} to {target.encode('utf-8')}: {e}")
+                return False
+            self.claimed.add(local_index.get_key(target))
+        if self.local_files:
+            self.local_files.move(source, target)
+        catalog.move_content_path(source, target)
+        self.set_path(item, target)
+        with self.lock:
+            self.moved += 1
+            self.bytes_saved += item.get("size") or 0
+            self.emptied.add(os.path.dirname(source))
+        return True
+
+    def record(self, item, local_file_path):
+        """Record the file of an item in place, the copy at its previous path is removed at the end of the run."""
+        previous = self.get_previous_path(item, local_file_path)
+        with self.lock:
+            self.claimed.add(local_index.get_key(local_file_path))
+            if previous:
+                self.previous_copies.append((previous, item["id"], local_file_path))
+        self.set_path(item, local_file_path)
+
+    def set_path(self, item, local_file_path):
+        path = self.get_relative_path(local_file_path)
+        if item.get(catalog.LOCAL_PATH) != path:
+            catalog.set_local_path(item["id"], path)
+            item[catalog.LOCAL_PATH] = path
+
+    def clean_up(self, failed=()):
+        """Remove the previous copies and the directories left empty, once the downloads are done.
+
+        failed are the new paths a staged file could not be renamed to, see staged_files.py.
+        """
+        failed = {local_index.get_key(path) for path in failed}
+        for path, item_id, new_path in self.previous_copies:
+            if local_index.get_key(new_path) in failed or not os.path.exists(new_path):
+                # Not replaced, the previous copy stays the file of the item
+                catalog.set_local_path(item_id, self.get_relative_path(path))
+                continue
+            if catalog.is_local_path_used(self.get_relative_path(path), item_id):
+                continue  # Names swapped on OneDrive, it is the file of another item now
+            try:
+                os.remove(path)
+                log.info(f"Removed the previous copy {path.encode('utf-8')}")
+                self.removed += 1
+                self.emptied.add(os.path.dirname(path))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                log.warning(f"Cannot remove the previous copy {path.encode('utf-8')}: {e}")
+        self.previous_copies = []
+        self.prune_directories()
+
+    def prune_directories(self):
+        """Remove the directories emptied by the run, up to the backup folder."""
+        root_key = local_index.get_key(self.root)
+        for directory in sorted(self.emptied, key=len, reverse=True):
+            key = local_index.get_key(directory)
+            while key != root_key and key.startswith(root_key + os.sep):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break  # Not empty, or removed with a sub directory already
+                self.pruned += 1
+                directory = os.path.dirname(directory)
+                key = local_index.get_key(directory)
+        self.emptied.clear()
+
+    def log_stats(self):
+        log.info(f"Moved files: {self.moved} moved instead of downloaded ({self.bytes_saved // (1024 * 1024)} MB saved), "
+                 f"{self.removed} previous copies and {self.pruned} empty directories removed")
@@ -0,0 +1,144 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import Counter
+
+import requests
+
+import config
+
+log = logging.getLogger(__name__)
+
+# One retry policy for listing and downloads. Failures are sorted in classes, each
+# class has its own retry budget per request (config.RETRY_BUDGETS). Waits follow
+# Retry-After when the service sends it, else a jittered exponential backoff.
+TRANSIENT = "transient"  # Network errors, timeouts, 5xx
+THROTTLED = "throttled"  # 429, 503
+AUTH_EXPIRED = "auth_expired"  # 401, 403: access token or pre-authenticated download url expired
+NOT_FOUND = "not_found"  # 404, 410
+PERMANENT = "permanent"  # Other errors, never retried
+
+_stats_lock = threading.Lock()
+_retried = Counter()
+_given_up = Counter()
+
+
+def classify_status(status) -> str:
+    if status is None:
+        return TRANSIENT
+    if status in (429, 503):
+        return THROTTLED
+    if status in (401, 403):
+        return AUTH_EXPIRED
+    if status in (404, 410):
+        return NOT_FOUND
+    if status == 408 or status >= 500:
+        return TRANSIENT
+    return PERMANENT
+
+
+def get_retry_after(headers):
+    """Seconds from a Retry-After header, None when missing or not a number of seconds."""
+    try:
+        return float(headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def classify(exc) -> tuple:
+    """Return (failure class, Retry-After seconds or None) for an exception raised by a request."""
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        return classify_status(exc.response.status_code), get_retry_after(exc.response.headers)
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError, asyncio.TimeoutError)):
+        return TRANSIENT, None
+    status = getattr(exc, "status", None)  # aiohttp.ClientResponseError
+    if isinstance(status, int):
+        return classify_status(status), get_retry_after(getattr(exc, "headers", None) or {})
+    if type(exc).__module__.startswith("aiohttp"):
+        return TRANSIENT, None
+    return PERMANENT, None
+
+
+class Retry:
+    """Retry state of one request, counting its failures per class against the budgets.
+
+        retry = retry_policy.Retry(f"Listing {folder}")
+        while True:
+            try:
+                return do_request()
+            except Exception as e:
+                if not retry.wait(*retry_policy.classify(e)):
+                    raise
+    """
+
+    def __init__(self, name: str, budgets: dict = None):
+        self.name = name
+        self.budgets = dict(config.RETRY_BUDGETS)
+        if budgets:
+            self.budgets.update(budgets)
+        self.failures = Counter()
+
+    def next_delay(self, failure_class: str, retry_after=None):
+        """Count a failure, return the seconds to wait before retrying or None when it must not be retried."""
+        self.failures[failure_class] += 1
+        if config.stop_flag or self.failures[failure_class] > self.budgets.get(failure_class, 0):
+            with _stats_lock:
+                _given_up[failure_class] += 1
+            return None
+        with _stats_lock:
+            _retried[failure_class] += 1
+        if retry_after is not None:
+            return retry_after
+        if failure_class in (AUTH_EXPIRED, NOT_FOUND):
+            # Retried at once with a new token or download url
+            return 0
+        # Full jitter: a random wait up to the exponential bound spreads the retries of all workers
+        return random.uniform(0, min(config.RETRY_MAX_DELAY, config.RETRY_BASE_DELAY * 2 ** (self.failures[failure_class] - 1)))
+
+    def reset(self):
+        """Give the budgets back, for long requests that made progress before failing (resumed downloads)."""
+        self.failures.clear()
+
+    def wait(self, failure_class: str, retry_after=None) -> bool:
+        """Wait before the next attempt, return False when the request must not be retried."""
+        delay = self.next_delay(failure_class, retry_after)
+        if delay is None:
+            log.error(f"{self.name}: giving up after {self.failures[failure_class]} {failure_class} failure(s)")
+            return False
+        log.warning(f"{self.name}: {failure_class} failure, retrying in {delay:.1f}s")
+        sleep(delay)
+        return not config.stop_flag
+
+    async def wait_async(self, failure_class: str, retry_after=None) -> bool:
+        delay = self.next_delay(failure_class, retry_after)
+        if delay is None:
+            log.error(f"{self.name}: giving up after {self.failures[failure_class]} {failure_class} failure(s)")
+            return False
+        log.warning(f"{self.name}: {failure_class} failure, retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        return not config.stop_flag
+
+
+def sleep(delay: float):
+    """time.sleep that returns early when the stop flag is set."""
+    end = time.monotonic() + delay
+    while not config.stop_flag:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(remaining, 0.5))
+
+
+def reset_stats():
+    with _stats_lock:
+        _retried.clear()
+        _given_up.clear()
+
+
+def log_stats():
+    with _stats_lock:
+        if _retried or _given_up:
+            log.info(f"Retries: {dict(_retried)}, given up: {dict(_given_up)}")
@@ -0,0 +1,132 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import catalog
+
+log = logging.getLogger(__name__)
+
+# Downloads are written to a staging file next to their destination and renamed into
+# place once complete: a stopped or crashed run never leaves a truncated file under the
+# real name. FSYNC_POLICY decides when the data reaches the disk before the rename:
+# "none" leaves it to the system, "file" syncs each file, "batch" keeps the complete
+# files staged and syncs then renames them together, every FSYNC_BATCH_FILES files or
+# FSYNC_BATCH_SECONDS seconds.
+FSYNC_NONE = "none"
+FSYNC_FILE = "file"
+FSYNC_BATCH = "batch"
+SYNC_WORKERS = 16  # Concurrent syncs of a batch, the file system commits them together
+
+
+def fsync_path(path):
+    # Windows only syncs files opened for writing
+    fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_directories(directories):
+    """Make renames durable, POSIX only: directories cannot be opened on Windows."""
+    if os.name != "posix":
+        return
+    for directory in directories:
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError as e:
+            log.warning(f"Cannot sync {directory.encode('utf-8')}: {e}")
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def move_into_place(staged_path, final_path, state_path=None):
+    os.replace(staged_path, final_path)
+    if state_path:
+        try:
+            os.remove(state_path)
+        except FileNotFoundError:
+            pass
+
+
+class FileCommitter:
+
+    def __init__(self, policy=None):
+        self.policy = policy or config.FSYNC_POLICY
+        if self.policy not in (FSYNC_NONE, FSYNC_FILE, FSYNC_BATCH):
+            log.warning(f"Unknown fsync policy {self.policy}, using {FSYNC_FILE}")
+            self.policy = FSYNC_FILE
+        self.lock = threading.Lock()
+        self.pending = []  # (staged path, final path, state path, item id)
+        self.failed = set()  # Final paths of the batched renames that failed
+        self.oldest = 0.0
+        self.committed = 0
+        self.batches = 0
+
+    def commit(self, staged_path, final_path, state_path=None, item_id=None):
+        """Rename a complete staged file to final_path, now or with the next batch.
+
+        state_path is the resume state of the staged file, removed once it is renamed.
+        The item is marked in error when a batched rename fails, raises otherwise.
+        """
+        if self.policy == FSYNC_BATCH:
+            with self.lock:
+                if not self.pending:
+                    self.oldest = time.monotonic()
+                self.pending.append((staged_path, final_path, state_path, item_id))
+                due = len(self.pending) >= config.FSYNC_BATCH_FILES
+            if due:
+                self.flush()
+            return
+        if self.policy == FSYNC_FILE:
+            fsync_path(staged_path)
+        move_into_place(staged_path, final_path, state_path)
+        if self.policy == FSYNC_FILE:
+            fsync_directories([os.path.dirname(final_path)])
+        with self.lock:
+            self.committed += 1
+
+    def flush_if_due(self):
+        with self.lock:
+            due = self.pending and time.monotonic() - self.oldest >= config.FSYNC_BATCH_SECONDS
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Sync and rename the staged files of the batch."""
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return
+        with ThreadPoolExecutor(max_workers=min(SYNC_WORKERS, len(batch))) as executor:
+            renamed = [path for path in executor.map(self.sync_and_move, batch) if path]
+        fsync_directories({os.path.dirname(path) for path in renamed})
+        with self.lock:
+            self.committed += len(renamed)
+            self.batches += 1
+
+    def sync_and_move(self, staged):
+        staged_path, final_path, state_path, item_id = staged
+        try:
+            fsync_path(staged_path)
+            move_into_place(staged_path, final_path, state_path)
+            return final_path
+        except OSError as e:
+            # The staged file stays, the item is downloaded again with the last errors or the next run
+            log.error(f"Cannot move {staged_path.encode('utf-8')} into place: {e}")
+            if item_id:
+                catalog.set_status(item_id, catalog.STATUS_ERROR)
+            with self.lock:
+                config.num_error += 1
+                self.failed.add(final_path)
+            return None
+
+    def log_stats(self):
+        batches = f" in {self.batches} batches" if self.policy == FSYNC_BATCH else ""
+        log.info(f"Files moved into place: {self.committed}{batches}, fsync policy {self.policy}")
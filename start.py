@@ -1,4 +1,4 @@
-import logging, threading, traceback, time
+import logging, threading, traceback, time, sys
 import argparse, configparser
 import customtkinter as ctk
 import tkinter as tk
@@ -6,7 +6,7 @@ from tkinter import messagebox, filedialog
 from PIL import Image
 from pathlib import Path
 
-import config,utils
+import config,utils,transfers,bandwidth
 from onedrive_authorization_utils import (
     save_refresh_token, load_access_token_from_file,
     procure_new_tokens_from_user, get_new_access_token_using_refresh_token,
@@ -65,6 +65,10 @@ class OneDriveDownloader(ctk.CTk):
         self.genlist_frame.grid_rowconfigure(0, weight=1)
         self.genlist_frame.grid_columnconfigure(0, weight=1)
         ctk.CTkLabel(self.genlist_frame, text="Set OneDrive Starting Directory and exclusions (separated by ;)").grid(row=0, column=0, sticky="w")
+        self.fullscan_var = ctk.IntVar()
+        self.fullscan_checkbox = ctk.CTkCheckBox(self.genlist_frame, text="Full scan", variable=self.fullscan_var)
+        self.fullscan_checkbox.deselect()
+        self.fullscan_checkbox.grid(row=0, column=1, pady=5)
         self.root_dir_var = ctk.StringVar()
         self.root_dir_var.set(config.ONEDRIVEDIR_PATH)
         ctk.CTkEntry(self.genlist_frame, textvariable=self.root_dir_var, width=350).grid(row=1, column=0, pady=5,padx=5)
@@ -88,6 +92,10 @@ class OneDriveDownloader(ctk.CTk):
         self.checkbox.deselect()
         self.checkbox.grid(row=2,column=1,pady=5)
         ctk.CTkButton(self.download_frame, text="Download Files", fg_color="green",hover_color="darkgreen",command=self.download_files).grid(row=2, column=0,pady=5)
+        ctk.CTkLabel(self.download_frame, text="Bandwidth limit in MB/s, megabytes per second (0 for none, empty for the schedule):").grid(row=3, column=0, sticky="w")
+        self.bandwidth_var = ctk.StringVar(value="")
+        ctk.CTkEntry(self.download_frame, textvariable=self.bandwidth_var, width=350).grid(row=4, column=0, pady=5,padx=5)
+        ctk.CTkButton(self.download_frame, text="Set Bandwidth Limit", command=self.set_bandwidth_limit).grid(row=4, column=1, pady=5,padx=5)
         self.download_frame.grid(row=2, column=0, padx=10, pady=5, sticky="nsew")
         
         self.status_frame = ctk.CTkFrame(self.main_frame)
@@ -132,48 +140,10 @@ class OneDriveDownloader(ctk.CTk):
     def update_download_status(self):
         
         try:
-            biggestsize = 0
-            biggestfile = "Unknown"
-            filefolder = "Unknown"
-            downloadstatus = ""
-            download_in_progress = config.downloadinprogress  # List of dicts
-            if not download_in_progress:
-                if config.progress_num > 0:
-                    return "No download in progress"
-                else:
-                    return ""
-
-            nb_download = len(download_in_progress)
-            downloaded = None
-            # Find the biggest file by size
-            for entry in download_in_progress:
-                try:
-                    size = int(entry.get("size", 0))
-                    if size > biggestsize:
-                        biggestfile = entry.get("name", "Unknown")
-                        biggestsize = size  # Convert bytes to MB
-                        filefolder = entry.get("parentReference", {}).get("path", "Unknown")
-                        filefolder = filefolder.replace("/drive/root:", "")
-                        downloaded = entry.get("downloaded", None)
-                except Exception:
-                    continue
-
-            if biggestsize < 1 * 1024 * 1024:
-                textsize = "<0"
-            else:
-                textsize = str(int(biggestsize / 1024 / 1024))
-            # Constructing status messages
-            if nb_download == 1:
-                downloadstatus = f"1 download in progress, file is {biggestfile} ({textsize}Mb) in {filefolder}"
-            else:
-                downloadstatus = f"{nb_download} downloads in progress, biggest file is {biggestfile} ({textsize}Mb) in {filefolder}"
-            if downloaded:
-                downloadstatus = f"{downloadstatus}\nProgress: {int(downloaded / 1024 / 1024)} / {int(biggestsize / 1024 / 1024)} Mb"
-                download_ratio = downloaded / (biggestsize or 1)
-                self.oneprogress_var.set(download_ratio)
-            else:
-                self.oneprogress_var.set(0)
+            downloadstatus, download_ratio = get_download_status("\n")
+            self.oneprogress_var.set(download_ratio)
         except Exception as e:
+            downloadstatus = ""
             logging.error(f"Error processing updateui")
             logging.error("Traceback: %s", traceback.format_exc())
         return downloadstatus
@@ -249,6 +219,7 @@ class OneDriveDownloader(ctk.CTk):
         if config.isprocessing==False:
             logging.info("User started file list generation.")
             config.isprocessing=True
+            config.USE_DELTA = not self.fullscan_checkbox.get()
             config.progress_num=-1
             self.progress_bar.configure(mode="indeterminate")
             self.progress_bar.start()
@@ -350,6 +321,13 @@ class OneDriveDownloader(ctk.CTk):
         config.status_str = f"OneDrive Root directory set to: {config.ONEDRIVEDIR_PATH}"
         logging.info(config.status_str)
     
+    def set_bandwidth_limit(self):
+        text = self.bandwidth_var.get()
+        try:
+            bandwidth.limiter.set_limit(parse_bandwidth_limit(text))
+        except ValueError:
+            messagebox.showerror("Bandwidth limit", f"{text} is not a number of MB/s")
+    
     def stop_download(self):
         logging.info("User requested to stop download.")
         config.stop_flag = True
@@ -364,41 +342,53 @@ class OneDriveDownloader(ctk.CTk):
         logging.info("Exiting Application")
         self.quit()
 
-def update_cmdline_download_status():
+def parse_bandwidth_limit(text):
+    """Bytes per second of a limit typed in MB/s (megabytes, 1024 * 1024 bytes), None for the schedule (empty or "auto")."""
+    text = text.strip().lower().replace(",", ".")
+    if text in ("", "auto"):
+        return None
+    limit = float(text)
+    if limit < 0:
+        raise ValueError(f"Negative bandwidth limit {text}")
+    return int(limit * 1024 * 1024)
 
-    try:
-        biggestsize=0
-        download_status=""
-        biggestfile="No biggest file"
-        download_in_progress = config.downloadinprogress  # List of dicts
-        if not download_in_progress:
-            if config.progress_num>0:
-                download_status="No download in progress"
-        else:
-            nb_download = len(download_in_progress)
-            downloaded=None
-            # Find the biggest file by size
-            for entry in download_in_progress:
-                if int(entry["size"])>biggestsize:
-                    biggestfile = entry["name"]
-                    biggestsize = int(entry["size"])  # Convert bytes to MB
-                    filefolder=entry["parentReference"]["path"]
-                    filefolder=filefolder.replace("/drive/root:","")
-                    downloaded=entry.get("downloaded",None)
+def read_bandwidth_limits():
+    """Command line: a limit typed while the script runs applies at once."""
+    for line in sys.stdin:
+        try:
+            bandwidth.limiter.set_limit(parse_bandwidth_limit(line))
+        except ValueError:
+            logging.warning(f"Type a bandwidth limit in MB/s, 0 for none or auto for the schedule, not {line.strip()}")
 
-            if biggestsize<1*1024*1024:
-                textsize="<0"
-            else:
-                textsize=str(int(biggestsize/1024/1024))
-            # Constructing status messages
-            if nb_download == 1:
-                download_status = f"1 download in progress, file is {biggestfile} ({textsize}Mb) in {filefolder}"
-            else:
-                download_status = f"{nb_download} downloads in progress, biggest file is {biggestfile} ({textsize}Mb) in {filefolder}"
-            if downloaded:
-                download_status=f"{download_status} - Progress: {int(downloaded/1024/1024)} / {int(biggestsize/1024/1024)} Mb"
-                download_ratio=downloaded / (biggestsize or 1)
+def get_download_status(separator):
+    """Status of the downloads in progress and the progress ratio of the biggest one."""
+    downloads = transfers.registry.get_downloads()
+    if not downloads:
+        return ("No download in progress" if config.progress_num > 0 else ""), 0
+    bytes_rate, files_rate = transfers.registry.get_rates()
+    biggest = downloads[0]
+    if biggest.size < 1 * 1024 * 1024:
+        textsize = "<0"
+    else:
+        textsize = str(int(biggest.size / 1024 / 1024))
+    rates = f"{bytes_rate / 1024 / 1024:.1f}MB/s, {files_rate:.1f} files/s"
+    limit = bandwidth.limiter.get_limit()
+    if limit:
+        rates = f"{rates}, limit {bandwidth.format_limit(limit)}"
+    # Constructing status messages
+    if len(downloads) == 1:
+        status = f"1 download in progress ({rates}), file is {biggest.name} ({textsize}Mb) in {biggest.folder}"
+    else:
+        status = f"{len(downloads)} downloads in progress ({rates}), biggest file is {biggest.name} ({textsize}Mb) in {biggest.folder}"
+    if not biggest.downloaded:
+        return status, 0
+    status = f"{status}{separator}Progress: {int(biggest.downloaded / 1024 / 1024)} / {int(biggest.size / 1024 / 1024)} Mb at {biggest.get_rate() / 1024 / 1024:.1f}MB/s"
+    return status, biggest.downloaded / (biggest.size or 1)
 
+def update_cmdline_download_status():
+
+    try:
+        download_status, _ = get_download_status(" - ")
         text=config.status_str
         text=f"{text} - {download_status}"
         if config.num_error>0:
@@ -444,6 +434,9 @@ def generate_and_download():
         save_access_token(new_access_token)
         access_token = new_access_token
         config.accesstoken=access_token
+        if sys.stdin and sys.stdin.isatty():
+            logging.info("Type a bandwidth limit in MB/s and Enter to change it while downloading, 0 for none, auto for the schedule")
+            threading.Thread(target=read_bandwidth_limits, daemon=True).start()
         rt = utils.RepeatedTimer(10, update_cmdline_download_status)
         download_the_list_of_files(0)
         rt.stop()
@@ -464,10 +457,19 @@ if __name__ == "__main__":
     ap.add_argument("-d", "--debug", action="store_true",help="Set debug mode")
     ap.add_argument("-r", "--root", help="Set OneDrive Root Directory")
     ap.add_argument("-l", "--localdir",help="Set Local Download Directory")
+    ap.add_argument("-f", "--full", action="store_true",help="Force a full scan of OneDrive instead of an incremental one")
+    ap.add_argument("-e", "--engine", choices=["async", "thread"], help="Set the engine used to list OneDrive folders")
+    ap.add_argument("-b", "--bandwidth", type=float, help="Limit the download bandwidth to this many MB/s (megabytes per second), instead of the schedule")
     args = ap.parse_args()
     
     if args.debug:
         config.LOG_LEVEL=logging.DEBUG
+    if args.full:
+        config.USE_DELTA=False
+    if args.engine:
+        config.ENUM_ENGINE=args.engine
+    if args.bandwidth is not None:
+        config.BANDWIDTH_LIMIT = config.BANDWIDTH_LIMIT_OFF_PEAK = int(args.bandwidth * 1024 * 1024)
     
     utils.init_logging()    
     logging.getLogger(__name__)
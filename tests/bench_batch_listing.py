@@ -0,0 +1,61 @@
+import os
+import time
+import shutil
+import argparse
+import logging
+import tempfile
+
+import support
+from support import config, catalog, generate_list, Drive
+
+# Folders listed per second by a full walk, with one request per folder page or up to 20
+# folders per Graph $batch request, against the stand-in server with a latency added to
+# every response. Run: python tests/bench_batch_listing.py [--latency 0.05] [--folders 300]
+
+
+def walk(server, directory, batch) -> tuple:
+    """Seconds, requests and sorted items of a full walk into a new catalog."""
+    support.use_catalog(os.path.join(directory, f"catalog-{batch}.db"))
+    config.USE_BATCH_LISTING = batch
+    config.stop_flag = False
+    server.reset_stats()
+    started = time.perf_counter()
+    generate_list.generate_list_of_all_files_and_folders(config.accesstoken)
+    elapsed = time.perf_counter() - started
+    items = sorted(catalog.get_connection().execute("SELECT id, parent_path, name FROM items"))
+    support.close_catalog()
+    return elapsed, server.requests, items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full walk speed with and without $batch listing")
+    parser.add_argument("--folders", type=int, default=300)
+    parser.add_argument("--files", type=int, default=1500)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to each response")
+    parser.add_argument("--engine", default=None, help="ENUM_ENGINE, async or thread")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    directory = tempfile.mkdtemp(prefix="onedrive-backup-bench-")
+    support.configure(directory)
+    config.USE_DELTA = False
+    if args.engine:
+        config.ENUM_ENGINE = args.engine
+    drive = Drive()
+    folders = support.add_random_tree(drive, args.folders, args.files)
+    server = support.serve(drive)
+    server.latency = args.latency
+    try:
+        results = {}
+        for batch in (False, True):
+            elapsed, requests, results[batch] = walk(server, directory, batch)
+            print(f"{'batch' if batch else 'single':>7}: {len(folders) / elapsed:8.1f} folders/s,"
+                  f" {requests:5} requests, {len(results[batch])} items in {elapsed:.2f}s")
+        print("Same items:", results[False] == results[True])
+    finally:
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
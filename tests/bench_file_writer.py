@@ -0,0 +1,121 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import support
+from support import config
+import file_writer
+
+# Write speed and fragmentation of .part files written concurrently, as several
+# downloads do: with the file object loop used before (buffered writes that grow the
+# file, one handle and a seek per segment) and with file_writer.PartWriter (preallocated,
+# positional writes). Times include syncing the files to disk. Extents come from
+# filefrag where it is installed. Run: python tests/bench_file_writer.py [--size 256]
+
+MB = 1024 * 1024
+CHUNK = MB
+
+
+def write_stream_old(path, size, chunk):
+    with open(path, "wb") as f:
+        for offset in range(0, size, CHUNK):
+            f.write(chunk[:min(CHUNK, size - offset)])
+
+
+def write_stream_new(path, size, chunk):
+    with file_writer.PartWriter(path, size) as writer:
+        cursor = writer.at(0)
+        for offset in range(0, size, CHUNK):
+            cursor.write(chunk[:min(CHUNK, size - offset)])
+
+
+def write_segments_old(path, size, chunk, segments):
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+    def write_segment(start, end):
+        with open(path, "r+b") as f:
+            f.seek(start)
+            for offset in range(start, end, CHUNK):
+                f.write(chunk[:min(CHUNK, end - offset)])
+
+    run_threads(write_segment, get_segments(size, segments))
+
+
+def write_segments_new(path, size, chunk, segments):
+    with file_writer.PartWriter(path, size) as writer:
+        def write_segment(start, end):
+            cursor = writer.at(start)
+            for offset in range(start, end, CHUNK):
+                cursor.write(chunk[:min(CHUNK, end - offset)])
+
+        run_threads(write_segment, get_segments(size, segments))
+
+
+def get_segments(size, segments) -> list:
+    step = -(-size // segments)
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+def run_threads(target, arguments):
+    threads = [threading.Thread(target=target, args=args) for args in arguments]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def count_extents(path):
+    """Extents of the file according to filefrag, None without it."""
+    if not shutil.which("filefrag"):
+        return None
+    output = subprocess.run(["filefrag", path], capture_output=True, text=True).stdout
+    try:
+        return int(output.rsplit(":", 1)[1].split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def run(directory, name, write_stream, write_segments, args) -> tuple:
+    """MB/s of the concurrent writes and the extents of each file."""
+    folder = os.path.join(directory, name)
+    os.makedirs(folder)
+    chunk = memoryview(os.urandom(CHUNK))
+    size = args.size * MB
+    jobs = [(write_stream, (os.path.join(folder, f"stream{k}.bin.part"), size, chunk)) for k in range(args.files)]
+    jobs.append((write_segments, (os.path.join(folder, "segmented.bin.part"), size * 2, chunk, args.segments)))
+    os.sync()
+    started = time.perf_counter()
+    run_threads(lambda write, arguments: write(*arguments), jobs)
+    os.sync()
+    elapsed = time.perf_counter() - started
+    extents = {os.path.basename(arguments[0]): count_extents(arguments[0]) for write, arguments in jobs}
+    shutil.rmtree(folder)
+    return (args.files + 2) * size / MB / elapsed, extents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent .part file writes, before and after PartWriter")
+    parser.add_argument("--size", type=int, default=256, help="MB per streamed file, twice that for the segmented one")
+    parser.add_argument("--files", type=int, default=4, help="Streamed files written at once")
+    parser.add_argument("--segments", type=int, default=4, help="Segments of the segmented file")
+    parser.add_argument("--directory", default=None, help="Where to write, on the disk to measure")
+    args = parser.parse_args()
+    config.PREALLOCATE = True
+
+    directory = tempfile.mkdtemp(prefix="onedrive-backup-bench-", dir=args.directory)
+    try:
+        for name, write_stream, write_segments in (("before", write_stream_old, write_segments_old),
+                                                   ("after", write_stream_new, write_segments_new)):
+            rate, extents = run(directory, name, write_stream, write_segments, args)
+            print(f"{name:>6}: {rate:7.0f} MB/s, extents {extents}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import time
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import support
+from support import config, Drive
+import http_client
+
+# Graph requests per second from worker threads, each request on a new connection as
+# with requests.get, or through the shared pooled session of http_client.py, against the
+# stand-in server. Run: python tests/bench_http_session.py [--requests 4000] [--workers 20]
+
+
+def measure(get, url, nb_requests, workers) -> float:
+    """Requests per second of get over url from workers threads."""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for response in executor.map(lambda _: get(url), range(nb_requests)):
+            response.raise_for_status()
+            response.json()
+    return nb_requests / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Request rate with and without the shared HTTP session")
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--workers", type=int, default=20)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    config.HTTP_POOL_SIZE = args.workers
+    drive = Drive()
+    folder = drive.add(drive.root, "A", folder=True)
+    server = support.serve(drive)
+    url = f"{server.api_url}me/drive/items/{folder}"
+    try:
+        for name, get in (("requests.get", lambda url: requests.get(url, timeout=config.TIMEOUT)),
+                          ("http_client.get", http_client.get)):
+            print(f"{name:>15}: {measure(get, url, args.requests, args.workers):7.0f} requests/s")
+        stats = http_client.get_stats()
+        print(f"Shared session: {stats['requests']} requests, {stats['connections']} connections opened, {stats['reused']} reused")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
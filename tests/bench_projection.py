@@ -0,0 +1,56 @@
+import os
+import shutil
+import argparse
+import logging
+import tempfile
+
+import support
+from support import config, catalog, generate_list, Drive
+
+# Bytes per item and requests per folder of a full walk, with the default Graph listing
+# (every field, 200 items per page) or the projected one ($select of the used fields and
+# $top=LISTING_PAGE_SIZE). Run: python tests/bench_projection.py [--files 20000]
+
+
+def walk(server, directory, name) -> tuple:
+    """Response bytes, requests and items of a full walk into a new catalog."""
+    support.use_catalog(os.path.join(directory, f"catalog-{name}.db"))
+    config.stop_flag = False
+    server.reset_stats()
+    generate_list.generate_list_of_all_files_and_folders(config.accesstoken)
+    items = catalog.count_files() + catalog.count_folders()
+    support.close_catalog()
+    return server.response_bytes, server.requests, items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Listing payload with and without $select and $top")
+    parser.add_argument("--folders", type=int, default=50)
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--batch", action="store_true", help="List through $batch as well")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    directory = tempfile.mkdtemp(prefix="onedrive-backup-bench-")
+    support.configure(directory)
+    config.USE_DELTA = False
+    config.USE_BATCH_LISTING = args.batch
+    drive = Drive()
+    # Files in a few folders, several pages each
+    folders = support.add_random_tree(drive, args.folders, args.files, file_folders=10)
+    server = support.serve(drive)
+    projected_query = generate_list.get_listing_query
+    try:
+        for name, query in (("default", lambda: ""), ("projected", projected_query)):
+            generate_list.get_listing_query = query
+            response_bytes, requests, items = walk(server, directory, name)
+            print(f"{name:>9}: {response_bytes / items:7.0f} bytes/item, {requests / len(folders):5.2f} requests/folder,"
+                  f" {response_bytes / 1024 / 1024:6.1f} MB for {items} items")
+    finally:
+        generate_list.get_listing_query = projected_query
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+import support
+from support import catalog, generate_list
+
+# Cost of finding the item of an expired download URL as the list grows: the catalog
+# lookups by URL (indexed) and by id (primary key) the refresh uses, against the linear
+# scan of the in-memory file list it replaced. Run: python tests/bench_url_lookup.py
+
+LOOKUPS = 2000
+
+
+def make_item(k) -> dict:
+    return {"id": f"I{k}", "name": f"f{k}.bin", "size": k, "file": {},
+            "parentReference": {"id": "P", "path": "/drive/root:/a"},
+            "@microsoft.graph.downloadUrl": f"https://example.com/dl/{k}?tempauth=abcdef{k}"}
+
+
+def fill_catalog(count):
+    scan = catalog.Scan()
+    for start in range(0, count, 10000):
+        scan.extend(make_item(k) for k in range(start, min(start + 10000, count)))
+
+
+def time_lookups(find, keys) -> float:
+    """Microseconds per call of find over keys."""
+    started = time.perf_counter()
+    for key in keys:
+        assert find(key) is not None
+    return (time.perf_counter() - started) / len(keys) * 1e6
+
+
+def scan_list(file_list, url):
+    for item in file_list:
+        if item["@microsoft.graph.downloadUrl"] == url:
+            return item
+    return None
+
+
+def run(count, directory) -> dict:
+    support.use_catalog(os.path.join(directory, f"catalog-{count}.db"))
+    fill_catalog(count)
+    picked = [(k * 7919) % count for k in range(LOOKUPS)]
+    urls = [make_item(k)["@microsoft.graph.downloadUrl"] for k in picked]
+    results = {
+        "by url": time_lookups(catalog.find_item_by_url, urls),
+        "by id": time_lookups(catalog.find_item_by_id, [f"I{k}" for k in picked]),
+        "refresh lookup": time_lookups(lambda url: generate_list.find_folder_and_file_from_url(url)[2], urls),
+    }
+    file_list = [make_item(k) for k in range(count)]
+    # Fewer lookups for the scan, spread over the list as the picked items are
+    samples = max(LOOKUPS * 10000 // count, 20)
+    scanned = [make_item(k * count // samples)["@microsoft.graph.downloadUrl"] for k in range(samples)]
+    results["list scan"] = time_lookups(lambda url: scan_list(file_list, url), scanned)
+    support.close_catalog()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download URL lookup cost as the list grows")
+    parser.add_argument("sizes", nargs="*", type=int, default=[10_000, 100_000, 1_000_000], help="Items in the list")
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp(prefix="onedrive-backup-bench-")
+    try:
+        print(f"{'items':>10} {'by url':>10} {'by id':>10} {'refresh':>10} {'list scan':>12}  (us per lookup)")
+        for count in args.sizes:
+            results = run(count, directory)
+            print(f"{count:>10} {results['by url']:>10.1f} {results['by id']:>10.1f}"
+                  f" {results['refresh lookup']:>10.1f} {results['list scan']:>12.1f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
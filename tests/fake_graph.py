@@ -0,0 +1,316 @@
+import re
+import json
+import time
+import socket
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote, quote, urlencode
+
+# Stand-in for the parts of Microsoft Graph the backup uses, served on localhost with
+# http.server: folder listings by path with paging and $select, /delta with tokens,
+# /$batch, item lookups and file downloads with Range requests. Latency, dropped
+# connections and slow transfers can be set on the server to test and benchmark
+# the listing and download code without a OneDrive account.
+
+
+class Drive:
+    """Items of a drive in memory. Every change is logged, /delta tokens are positions in that log."""
+
+    def __init__(self):
+        self.items = {}  # id: {id, name, parent, folder, content, mtime, etag}
+        self.log = []  # Ids of the items changed, in order
+        self.deleted = set()
+        self.count = 0
+        self.lock = threading.Lock()
+        self.root = self.add(None, "root", folder=True)
+
+    def add(self, parent, name, folder=False, content=b"") -> str:
+        self.count += 1
+        item_id = f"ID{self.count}"
+        self.items[item_id] = dict(id=item_id, name=name, parent=parent, folder=folder, content=content,
+                                   mtime="2024-01-01T00:00:00Z", etag=f"{item_id}-1")
+        self.log.append(item_id)
+        return item_id
+
+    def touch(self, item_id, content=None, name=None, parent=None):
+        """Change the content, the name or the folder of an item, it gets a new eTag."""
+        item = self.items[item_id]
+        if content is not None:
+            item["content"] = content
+        if name is not None:
+            item["name"] = name
+        if parent is not None:
+            item["parent"] = parent
+        version = int(item["etag"].rsplit("-", 1)[1]) + 1
+        item["etag"] = f"{item_id}-{version}"
+        self.log.append(item_id)
+
+    def delete(self, item_id):
+        for child in self.get_children(item_id):
+            self.delete(child)
+        self.items.pop(item_id)
+        self.deleted.add(item_id)
+        self.log.append(item_id)
+
+    def get_children(self, item_id) -> list:
+        return sorted(child for child, item in self.items.items() if item["parent"] == item_id)
+
+    def get_descendants(self, item_id) -> list:
+        descendants = []
+        for child in self.get_children(item_id):
+            descendants.append(child)
+            descendants += self.get_descendants(child)
+        return descendants
+
+    def path(self, item_id) -> str:
+        """Graph parentReference.path of the children of the item."""
+        item = self.items[item_id]
+        if item["parent"] is None:
+            return "/drive/root:"
+        return f"{self.path(item['parent'])}/{item['name']}"
+
+    def find(self, path):
+        """Id of the item at a path relative to the root, None when there is none."""
+        current = self.root
+        for name in filter(None, path.strip("/").split("/")):
+            matches = [child for child in self.get_children(current) if self.items[child]["name"] == name]
+            if not matches:
+                return None
+            current = matches[0]
+        return current
+
+    def to_json(self, item_id, base, with_path=True) -> dict:
+        """The item as Graph returns it, with the fields the backup does not read, as a real payload has."""
+        item = self.items[item_id]
+        user = {"email": "someone@example.com", "displayName": "Some One", "id": "abcdef0123456789"}
+        data = {
+            "id": item_id, "name": item["name"], "eTag": item["etag"], "cTag": item["etag"],
+            "lastModifiedDateTime": item["mtime"], "createdDateTime": "2023-01-01T00:00:00Z",
+            "webUrl": f"https://onedrive.live.com/redir?resid={item_id}&page=Edit",
+            "createdBy": {"user": user, "application": {"displayName": "test", "id": "44048800"}},
+            "lastModifiedBy": {"user": user, "application": {"displayName": "OneDrive", "id": "44048800"}},
+            "fileSystemInfo": {"createdDateTime": "2023-01-01T00:00:00Z", "lastModifiedDateTime": item["mtime"]},
+            "shared": {"effectiveRoles": ["write"], "owner": {"user": user}, "scope": "users"},
+            "reactions": {"commentCount": 0},
+        }
+        if item["parent"] is None:
+            data["root"] = {}
+            data["folder"] = {"childCount": len(self.get_children(item_id))}
+            return data
+        data["parentReference"] = {"id": item["parent"], "driveId": "D"}
+        if with_path:  # /delta gives no paths
+            data["parentReference"]["path"] = self.path(item["parent"])
+        if item["folder"]:
+            data["folder"] = {"childCount": len(self.get_children(item_id))}
+            data["size"] = 0
+        else:
+            data["size"] = len(item["content"])
+            data["file"] = {"mimeType": "application/octet-stream",
+                            "hashes": {"sha1Hash": hashlib.sha1(item["content"]).hexdigest().upper()}}
+            data["image"] = {"height": 3000, "width": 4000}
+            data["@microsoft.graph.downloadUrl"] = f"{base}/dl/{item_id}?v={item['etag']}"
+        return data
+
+
+def select(data, query) -> dict:
+    fields = query.get("$select")
+    if not fields:
+        return data
+    keep = set(fields[0].split(","))
+    return {key: value for key, value in data.items() if key in keep or key.startswith("@")}
+
+
+class GraphServer(ThreadingHTTPServer):
+    """The stand-in server of a drive. Its settings can be changed while it serves."""
+
+    daemon_threads = True
+
+    def __init__(self, drive: Drive):
+        super().__init__(("127.0.0.1", 0), GraphHandler)
+        self.drive = drive
+        self.latency = 0.0  # Seconds before each response
+        self.page_size = 200  # Items per listing page without $top, as Graph
+        self.drop_after = None  # Bytes of a download sent before its connection is dropped
+        self.bytes_per_second = None  # Throughput of each download
+        self.failing = set()  # Parts of the paths answered with an error 500
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    @property
+    def api_url(self) -> str:
+        """The BASE_URL of the backup modules."""
+        return f"{self.base_url}/v1.0/"
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.requests = 0
+            self.response_bytes = 0
+            self.paths = []
+            self.ranges = []  # Range headers of the downloads
+
+    def start(self) -> "GraphServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class GraphHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data, code=200):
+        body = json.dumps(data).encode()
+        with self.server.stats_lock:
+            self.server.response_bytes += len(body)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def count(self):
+        with self.server.stats_lock:
+            self.server.requests += 1
+            self.server.paths.append(self.path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def do_POST(self):
+        self.count()
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        responses = []
+        for request in body["requests"]:
+            url = request["url"] if request["url"].startswith("/v1.0") else "/v1.0" + request["url"]
+            code, data = self.route(url)
+            responses.append({"id": request["id"], "status": code, "body": data})
+        self.send_json({"responses": responses})
+
+    def do_GET(self):
+        self.count()
+        path = urlparse(self.path).path
+        if path.startswith("/dl/") or path.endswith("/content"):
+            self.send_content(path.split("/")[2] if path.startswith("/dl/") else path.split("/")[-2])
+            return
+        code, data = self.route(self.path)
+        self.send_json(data, code)
+
+    def send_content(self, item_id):
+        item = self.server.drive.items.get(item_id)
+        if item is None:
+            self.send_json({"error": {"code": "itemNotFound"}}, 404)
+            return
+        data = item["content"]
+        start, end, code = 0, len(data) - 1, 200
+        requested = self.headers.get("Range")
+        with self.server.stats_lock:
+            self.server.ranges.append(requested)
+        if requested:
+            match = re.match(r"bytes=(\d+)-(\d*)", requested)
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(data) - 1
+            code = 206
+        body = data[start:end + 1]
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", item["etag"])
+        if code == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.end_headers()
+        drop_after = self.server.drop_after
+        if drop_after is not None and len(body) > drop_after:
+            body = body[:drop_after]
+        piece = 256 * 1024 if self.server.bytes_per_second else len(body) or 1
+        for offset in range(0, len(body), piece):
+            self.wfile.write(body[offset:offset + piece])
+            if self.server.bytes_per_second:
+                time.sleep(piece / self.server.bytes_per_second)
+        if drop_after is not None and len(data[start:end + 1]) > drop_after:
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+
+    def route(self, url):
+        """(status, body) of a Graph request other than a download."""
+        parsed = urlparse(url)
+        query = parse_qs(parsed.query)
+        path = unquote(parsed.path)
+        drive = self.server.drive
+        base = self.server.base_url
+        if any(part in path for part in self.server.failing):
+            return 500, {"error": {"code": "generalException"}}
+        with drive.lock:
+            match = re.match(r"^/v1\.0/+(?:me/)?drive/items/([^/]+)$", path)
+            if match:
+                if match.group(1) not in drive.items:
+                    return 404, {"error": {"code": "itemNotFound"}}
+                return 200, select(drive.to_json(match.group(1), base), query)
+            if path.rstrip("/") == "/v1.0/me/drive/root":
+                return 200, drive.to_json(drive.root, base)
+            if path.endswith("/delta"):
+                return self.route_delta(parsed, query, path)
+            if path.endswith("/children"):
+                return self.route_children(query, path)
+            match = re.match(r"^/v1\.0/+(?:me/)?drive/root:(.*?):?$", path)
+            if match:
+                item_id = drive.find(match.group(1))
+                if item_id is None:
+                    return 404, {"error": {"code": "itemNotFound"}}
+                return 200, drive.to_json(item_id, base)
+        return 404, {"error": {"code": "notFound", "path": path}}
+
+    def route_children(self, query, path):
+        drive = self.server.drive
+        if path.rstrip("/").endswith("drive/root/children"):
+            folder = drive.root
+        else:
+            folder = drive.find(re.match(r"^/v1\.0/+(?:me/)?drive/root:(.*):/children$", path).group(1))
+        if folder is None:
+            return 404, {"error": {"code": "itemNotFound"}}
+        children = drive.get_children(folder)
+        top = min(int(query.get("$top", [self.server.page_size])[0]), 999)
+        skip = int(query.get("skip", ["0"])[0])
+        page = {"value": [select(drive.to_json(child, self.server.base_url), query) for child in children[skip:skip + top]]}
+        if skip + top < len(children):
+            next_query = {key: values[0] for key, values in query.items()}
+            next_query["skip"] = skip + top
+            page["@odata.nextLink"] = f"{self.server.base_url}{quote(path)}?{urlencode(next_query)}"
+        return 200, page
+
+    def route_delta(self, parsed, query, path):
+        drive = self.server.drive
+        base = self.server.base_url
+        if path.rstrip("/").endswith("/me/drive/root/delta"):
+            scope = drive.root
+        else:
+            scope = drive.find(re.match(r"^/v1\.0/+(?:me/)?drive/root:(.*):/delta$", path).group(1))
+        token = query.get("token", [None])[0]
+        if token == "latest":
+            return 200, {"value": [], "@odata.deltaLink": f"{base}{parsed.path}?token={len(drive.log)}"}
+        if token == "expired":
+            return 410, {"error": {"code": "resyncRequired"}}
+        start = int(token) if token else 0
+        skip = int(query.get("skip", ["0"])[0])
+        changed = list(dict.fromkeys(reversed(drive.log[start:])))[::-1]  # Last change of each item, in order
+        in_scope = set([scope] + drive.get_descendants(scope))
+        values = []
+        for item_id in changed:
+            if item_id in drive.deleted and item_id not in drive.items:
+                values.append({"id": item_id, "deleted": {"state": "deleted"}, "parentReference": {"id": "x"}})
+            elif item_id in in_scope:
+                values.append(drive.to_json(item_id, base, with_path=False))
+        page = {"value": values[skip:skip + self.server.page_size]}
+        if skip + self.server.page_size < len(values):
+            page["@odata.nextLink"] = f"{base}{parsed.path}?token={start}&skip={skip + self.server.page_size}"
+        else:
+            page["@odata.deltaLink"] = f"{base}{parsed.path}?token={len(drive.log)}"
+        return 200, page
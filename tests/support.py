@@ -0,0 +1,87 @@
+import os
+import sys
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+# Tests and benchmarks run from the tests directory or the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+config.initialize()
+import catalog, generate_list, download_list, graph_batch
+from fake_graph import Drive, GraphServer
+
+
+def use_catalog(path):
+    """Point the catalog to another database, the connections of the previous one are dropped."""
+    close_catalog()
+    catalog.CATALOG_DB = path
+    catalog._local = threading.local()
+    catalog._schema_ready = False
+
+
+def close_catalog():
+    conn = getattr(catalog._local, "conn", None)
+    if conn is not None:
+        conn.close()
+        catalog._local.conn = None
+
+
+def serve(drive) -> GraphServer:
+    """Start a stand-in Graph server for the drive, the listing and download modules use it."""
+    server = GraphServer(drive).start()
+    for module in (generate_list, download_list, graph_batch):
+        module.BASE_URL = server.api_url
+    return server
+
+
+def add_random_tree(drive, nb_folders, nb_files, file_folders=None, seed=1) -> list:
+    """Add folders under random folders and files in random folders, return the folder ids.
+
+    Files go to the first file_folders folders only when it is set.
+    """
+    rng = random.Random(seed)
+    folders = [drive.root]
+    for k in range(nb_folders):
+        folders.append(drive.add(rng.choice(folders), f"folder {k}#", folder=True))
+    for k in range(nb_files):
+        drive.add(rng.choice(folders[:file_folders] if file_folders else folders), f"file{k}.jpg", content=b"x" * (k % 1000))
+    return folders
+
+
+def configure(directory):
+    """Settings of a backup to directory, with short retry delays and no free space margin."""
+    config.initialize()
+    config.OFFLINEBACKUP_PATH = os.path.join(directory, "backup")
+    config.accesstoken = "token"
+    config.MIN_FREE_SPACE_BYTES = 0
+    config.RETRY_BASE_DELAY = 0.01
+    config.RETRY_MAX_DELAY = 0.05
+    use_catalog(os.path.join(directory, "catalog.db"))
+
+
+class BackupTestCase(unittest.TestCase):
+    """A drive served by a stand-in Graph server, backed up to a temporary directory."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="onedrive-backup-test-")
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        configure(self.directory)
+        self.addCleanup(close_catalog)
+        self.drive = Drive()
+        self.server = serve(self.drive)
+        self.addCleanup(self.server.stop)
+
+    def list_drive(self):
+        config.stop_flag = False
+        generate_list.generate_list_of_all_files_and_folders(config.accesstoken)
+
+    def download(self, perror=0):
+        config.stop_flag = False
+        download_list.download_the_list_of_files(perror)
+
+    def get_local_path(self, item_id) -> str:
+        return os.path.join(config.OFFLINEBACKUP_PATH, self.drive.path(item_id).replace("/drive/root:/", "", 1))
@@ -0,0 +1,104 @@
+import unittest
+from urllib.parse import unquote
+
+from support import BackupTestCase, config, catalog, generate_list
+
+
+class DeltaListingTest(BackupTestCase):
+    """An incremental listing through /delta gives the catalog a full walk gives."""
+
+    def setUp(self):
+        super().setUp()
+        self.server.page_size = 3  # Several pages per folder and per delta round
+        drive = self.drive
+        self.a = drive.add(drive.root, "A", folder=True)
+        self.b = drive.add(self.a, "B b", folder=True)
+        self.c = drive.add(drive.root, "C", folder=True)
+        self.files = [drive.add(self.a, f"f{k}.txt", content=b"x" * k) for k in range(5)]
+        for k in range(4):
+            drive.add(self.b, f"g{k}.txt", content=b"y" * k)
+        drive.add(self.c, "h.txt", content=b"h")
+
+    def get_catalog(self):
+        # Paths from /delta are built from the folder names, the walk gets them encoded or not from Graph
+        rows = catalog.get_connection().execute("SELECT id, name, parent_path, is_folder, size, etag FROM items")
+        return sorted((item_id, name, unquote(path or ""), is_folder, size, etag) for item_id, name, path, is_folder, size, etag in rows)
+
+    def full_walk(self):
+        generate_list.clear_delta_token()
+        self.list_drive()
+        return self.get_catalog()
+
+    def change_drive(self):
+        drive = self.drive
+        drive.add(self.b, "new.txt", content=b"new")
+        drive.touch(self.a, name="A2")  # Renamed folder, its descendants change path
+        drive.delete(self.c)
+        drive.touch(self.b, parent=drive.root)  # Moved folder
+        drive.touch(self.files[1], content=b"changed")
+        folder = drive.add(drive.root, "D", folder=True)
+        drive.add(folder, "z.txt", content=b"z")
+
+    def test_first_run_saves_a_delta_token(self):
+        self.list_drive()
+        self.assertIsNotNone(catalog.get_state("deltaLink"))
+        self.assertEqual(catalog.count_files(), 10)
+
+    def test_delta_run_gives_the_list_of_a_full_walk(self):
+        self.list_drive()
+        self.change_drive()
+        self.server.reset_stats()
+        self.list_drive()
+        self.assertFalse([path for path in self.server.paths if "/children" in path], "a delta run lists no folder")
+        incremental = self.get_catalog()
+        self.assertEqual(incremental, self.full_walk())
+        self.assertNotIn(self.c, [row[0] for row in incremental])
+
+    def test_delta_run_without_change_keeps_the_list(self):
+        before = self.full_walk()
+        self.list_drive()
+        self.assertEqual(self.get_catalog(), before)
+
+    def test_expired_token_falls_back_to_a_full_walk(self):
+        self.list_drive()
+        self.change_drive()
+        with catalog.transaction():
+            catalog.set_state("deltaLink", f"{self.server.api_url}me/drive/root/delta?token=expired")
+        self.server.reset_stats()
+        self.list_drive()
+        self.assertTrue([path for path in self.server.paths if "/children" in path or "$batch" in path])
+        self.assertNotIn("expired", catalog.get_state("deltaLink"))
+        self.assertEqual(self.get_catalog(), self.full_walk())
+
+    def test_failed_folder_listing_keeps_its_items_and_saves_no_token(self):
+        for engine in ("async", "thread"):
+            for batch in (True, False):
+                with self.subTest(engine=engine, batch=batch):
+                    config.ENUM_ENGINE = engine
+                    config.USE_BATCH_LISTING = batch
+                    complete = self.full_walk()
+                    self.server.failing = {"/B b:/children"}
+                    try:
+                        self.full_walk()
+                    finally:
+                        self.server.failing = set()
+                    self.assertIsNone(catalog.get_state("deltaLink"))
+                    self.assertEqual(self.get_catalog(), complete)
+                    self.list_drive()  # Full walk again, without a token
+                    self.assertIsNotNone(catalog.get_state("deltaLink"))
+                    self.assertEqual(self.get_catalog(), complete)
+
+    def test_delta_run_of_a_folder(self):
+        config.ONEDRIVEDIR_PATH = "/A"
+        self.list_drive()
+        self.drive.add(self.a, "s.txt", content=b"s")
+        self.drive.add(self.c, "outside.txt", content=b"o")
+        self.list_drive()
+        incremental = self.get_catalog()
+        self.assertIn("s.txt", [row[1] for row in incremental])
+        self.assertNotIn("outside.txt", [row[1] for row in incremental])
+        self.assertEqual(incremental, self.full_walk())
+
+
+if __name__ == "__main__":
+    unittest.main()
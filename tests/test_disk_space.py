@@ -0,0 +1,55 @@
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from support import config
+import disk_space
+
+
+class SlowSpaceAccountant(disk_space.SpaceAccountant):
+    """Samples slowly, as on a busy disk, so that workers check the space at the same time."""
+
+    def sample(self):
+        super().sample()
+        time.sleep(0.01)
+
+
+class SpaceAccountantTest(unittest.TestCase):
+    """Reservations from concurrent workers never add up to more than the free space."""
+
+    def setUp(self):
+        config.initialize()
+        config.MIN_FREE_SPACE_BYTES = 0
+        config.SPACE_SAMPLE_INTERVAL = 0  # A sample on every check, as when the interval ends
+        self.directory = tempfile.mkdtemp(prefix="onedrive-backup-test-")
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.accountant = SlowSpaceAccountant(self.directory)
+
+    def test_concurrent_reservations_do_not_overrun(self):
+        size = int(self.accountant.get_available() * 0.6)
+        barrier = threading.Barrier(8)
+        granted = []
+
+        def reserve(k):
+            barrier.wait()
+            granted.append(self.accountant.reserve({"id": f"I{k}", "size": size}))
+
+        threads = [threading.Thread(target=reserve, args=(k,)) for k in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(granted.count(True), 1)
+
+    def test_release_gives_the_space_back(self):
+        item = {"id": "I1", "size": int(self.accountant.get_available() * 0.6)}
+        self.assertTrue(self.accountant.reserve(item))
+        self.assertFalse(self.accountant.fits(item))
+        self.accountant.release(item)
+        self.assertTrue(self.accountant.fits(item))
+
+
+if __name__ == "__main__":
+    unittest.main()
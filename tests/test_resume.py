@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import threading
+import unittest
+
+from support import BackupTestCase, config, catalog
+
+MB = 1024 * 1024
+
+
+class ResumeTest(BackupTestCase):
+    """Big files continue an interrupted download with a Range request instead of starting over."""
+
+    def setUp(self):
+        super().setUp()
+        config.USE_DELTA = False
+        config.RESUME_MIN_SIZE = MB
+        config.RESUME_CHECKPOINT = 256 * 1024
+        config.SEGMENTED_MIN_SIZE = 64 * MB
+        self.content = os.urandom(8 * MB)
+        self.big = self.drive.add(self.drive.root, "big.bin", content=self.content)
+        self.drive.add(self.drive.root, "small.bin", content=b"s" * 1000)
+        self.list_drive()
+        self.path = self.get_local_path(self.big)
+
+    def get_ranges(self) -> list:
+        return [requested for path, requested in zip(self.server.paths, self.server.ranges) if self.big in path]
+
+    def assert_downloaded(self):
+        with open(self.path, "rb") as f:
+            self.assertTrue(f.read() == self.content, "downloaded content differs")
+        self.assertEqual(sorted(os.listdir(config.OFFLINEBACKUP_PATH)), ["big.bin", "small.bin"])
+        self.assertEqual(catalog.count_files("error"), 0)
+
+    def write_partial(self, size, etag):
+        os.makedirs(config.OFFLINEBACKUP_PATH, exist_ok=True)
+        with open(self.path + ".part", "wb") as f:
+            f.write(self.content[:size])
+        with open(self.path + ".part.json", "w") as f:
+            json.dump({"id": self.big, "eTag": etag, "segments": [[0, len(self.content), size]]}, f)
+
+    def stop_once_saved(self, size):
+        """Set the stop flag once the download saved size bytes, as the stop button does."""
+        config.MAX_CHUNK_SIZE = 256 * 1024  # Reads short enough to see the flag before the end
+        def watch():
+            deadline = time.monotonic() + 30
+            while time.monotonic() < deadline:
+                try:
+                    with open(self.path + ".part.json") as f:
+                        if json.load(f)["segments"][0][2] >= size:
+                            break
+                except (OSError, ValueError, KeyError, IndexError):
+                    pass
+                time.sleep(0.01)
+            config.stop_flag = True
+        threading.Thread(target=watch, daemon=True).start()
+
+    def test_dropped_connections_resume_in_the_same_run(self):
+        self.server.drop_after = 3 * MB
+        self.server.reset_stats()
+        self.download()
+        self.assert_downloaded()
+        self.assertEqual(self.get_ranges(), [None, f"bytes={3 * MB}-", f"bytes={6 * MB}-"])
+
+    def test_stopped_download_resumes_on_the_next_run(self):
+        self.server.bytes_per_second = 4 * MB
+        self.stop_once_saved(2 * MB)
+        self.download()
+        self.assertFalse(os.path.exists(self.path))
+        with open(self.path + ".part.json") as f:
+            offset = json.load(f)["segments"][0][2]
+        self.assertGreaterEqual(offset, 2 * MB)
+
+        self.server.bytes_per_second = None
+        self.server.reset_stats()
+        self.download()
+        self.assert_downloaded()
+        self.assertEqual(self.get_ranges(), [f"bytes={offset}-"])
+
+    def test_partial_download_of_a_changed_file_starts_over(self):
+        self.write_partial(5 * MB, etag="old")
+        self.server.reset_stats()
+        self.download()
+        self.assert_downloaded()
+        self.assertEqual(self.get_ranges(), [None])
+
+    def test_complete_partial_download_is_not_fetched_again(self):
+        self.write_partial(len(self.content), etag=self.drive.items[self.big]["etag"])
+        self.server.reset_stats()
+        self.download()
+        self.assert_downloaded()
+        self.assertEqual(self.get_ranges(), [])
+
+
+class SegmentedResumeTest(ResumeTest):
+    """The same with files downloaded in parallel segments."""
+
+    def setUp(self):
+        super().setUp()
+        config.SEGMENTED_MIN_SIZE = 4 * MB
+        config.SEGMENT_COUNT = 4
+
+    def test_dropped_connections_resume_in_the_same_run(self):
+        self.server.drop_after = MB
+        self.server.reset_stats()
+        self.download()
+        self.assert_downloaded()
+        segment = 2 * MB
+        expected = [f"bytes={start}-{start + segment - 1}" for start in range(0, 8 * MB, segment)]
+        expected += [f"bytes={start + MB}-{start + segment - 1}" for start in range(0, 8 * MB, segment)]
+        self.assertEqual(sorted(self.get_ranges()), sorted(expected))
+
+    def test_stopped_download_resumes_on_the_next_run(self):
+        self.server.bytes_per_second = MB
+        self.stop_once_saved(256 * 1024)
+        self.download()
+        self.assertFalse(os.path.exists(self.path))
+        with open(self.path + ".part.json") as f:
+            segments = json.load(f)["segments"]
+        self.assertEqual(len(segments), 4)
+
+        self.server.bytes_per_second = None
+        self.server.reset_stats()
+        self.download()
+        self.assert_downloaded()
+        expected = [f"bytes={position}-{end - 1}" for start, end, position in segments if position < end]
+        self.assertEqual(sorted(self.get_ranges()), sorted(expected))
+
+    def test_partial_download_of_a_changed_file_starts_over(self):
+        self.write_partial(5 * MB, etag="old")
+        self.server.reset_stats()
+        self.download()
+        self.assert_downloaded()
+        self.assertEqual(sorted(self.get_ranges()), sorted(f"bytes={start}-{start + 2 * MB - 1}" for start in range(0, 8 * MB, 2 * MB)))
+
+
+if __name__ == "__main__":
+    unittest.main()
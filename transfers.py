@@ -0,0 +1,164 @@
+import time
+import threading
+from collections import deque
+
+# Items in flight in the download lanes, keyed by item id. Writers count the bytes of
+# their transfer as they write them, the status of the GUI and the command line reads
+# the transfers and the rates from here. Counters are kept per lane for the time left:
+# the lanes run side by side, the run ends with the slowest one.
+RATE_WINDOW = 10  # Seconds of history of the aggregate rates
+
+
+class Transfer:
+    """An item in a lane, counted as a download once started."""
+
+    __slots__ = ("id", "name", "folder", "size", "group", "started", "downloading", "downloaded", "resumed", "lock")
+
+    def __init__(self, item, group: str):
+        self.id = item["id"]
+        self.name = item.get("name", "Unknown")
+        self.folder = item.get("parentReference", {}).get("path", "Unknown").replace("/drive/root:", "")
+        self.size = item.get("size") or 0
+        self.group = group
+        self.started = time.monotonic()
+        self.downloading = False
+        self.downloaded = 0
+        self.resumed = 0  # Bytes already on disk from a previous run
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.downloading = True
+        self.started = time.monotonic()
+
+    def resume(self, offset: int):
+        self.downloaded = self.resumed = offset
+
+    def set(self, downloaded: int):
+        """Bytes of the file on disk, for transfers written by one thread."""
+        self.downloaded = downloaded
+
+    def add(self, count: int):
+        """Count bytes written by one of the threads of the transfer."""
+        with self.lock:
+            self.downloaded += count
+
+    @property
+    def written(self) -> int:
+        """Bytes written in this run."""
+        return self.downloaded - self.resumed
+
+    def get_rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+
+class TransferGroup:
+    """Counters of the items of one lane."""
+
+    def __init__(self, name: str, bytes_left: int):
+        self.name = name
+        self.started = time.monotonic()
+        self.bytes_left = bytes_left  # Size of the items of the catalog not processed yet
+        self.bytes_processed = 0
+        self.bytes_written = 0  # By the transfers that ended
+        self.files_downloaded = 0
+
+
+class TransferRegistry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.transfers = {}  # item id: Transfer
+        self.groups = {}  # name: TransferGroup
+        self.samples = deque()  # (time, bytes written, files downloaded)
+
+    def start_run(self):
+        with self.lock:
+            self.transfers = {}
+            self.groups = {}
+            self.samples.clear()
+
+    def add_group(self, name: str, bytes_left: int) -> TransferGroup:
+        with self.lock:
+            group = self.groups[name] = TransferGroup(name, bytes_left)
+        return group
+
+    def begin(self, item, group: str) -> Transfer:
+        transfer = Transfer(item, group)
+        with self.lock:
+            self.transfers[transfer.id] = transfer
+        return transfer
+
+    def get(self, item_id):
+        return self.transfers.get(item_id)
+
+    def end(self, transfer: Transfer, processed: bool = True):
+        """Remove a transfer, its item counts as processed in its group unless it is submitted again later."""
+        with self.lock:
+            self.transfers.pop(transfer.id, None)
+            group = self.groups.get(transfer.group)
+            if group is None or not processed:
+                return
+            group.bytes_left -= transfer.size
+            group.bytes_processed += transfer.size
+            group.bytes_written += transfer.written
+            group.files_downloaded += transfer.downloading
+
+    def get_downloads(self) -> list:
+        """The transfers downloading, biggest first."""
+        with self.lock:
+            downloads = [transfer for transfer in self.transfers.values() if transfer.downloading]
+        downloads.sort(key=lambda transfer: transfer.size, reverse=True)
+        return downloads
+
+    def get_totals(self, group=None):
+        """(bytes written, files downloaded) of the run or of a group, transfers in flight included."""
+        with self.lock:
+            groups = [self.groups[group]] if group else list(self.groups.values())
+            written = sum(transfer.written for transfer in self.transfers.values() if group in (None, transfer.group))
+        return written + sum(g.bytes_written for g in groups), sum(g.files_downloaded for g in groups)
+
+    def get_rates(self):
+        """(bytes/s, files/s) of the downloads over the last RATE_WINDOW seconds."""
+        now = time.monotonic()
+        written, files = self.get_totals()
+        with self.lock:
+            self.samples.append((now, written, files))
+            while len(self.samples) > 2 and now - self.samples[1][0] >= RATE_WINDOW:
+                self.samples.popleft()
+            then, then_written, then_files = self.samples[0]
+            if now - then < 1 and self.groups:
+                # First calls of a run, rates since its start
+                then, then_written, then_files = min(g.started for g in self.groups.values()), 0, 0
+        elapsed = now - then
+        if elapsed <= 0:
+            return 0.0, 0.0
+        return (written - then_written) / elapsed, (files - then_files) / elapsed
+
+    def get_group_eta(self, group: TransferGroup):
+        """Seconds left in the group, None until some bytes are downloaded."""
+        written, _ = self.get_totals(group.name)
+        with self.lock:
+            in_flight = [transfer for transfer in self.transfers.values() if transfer.group == group.name]
+            # Resumed bytes were downloaded by a previous run, they are not left
+            bytes_left = group.bytes_left - sum(transfer.downloaded for transfer in in_flight)
+            processed = group.bytes_processed
+            processed_written = group.bytes_written
+        if bytes_left <= 0:
+            return 0
+        if not written:
+            return None
+        rate = written / (time.monotonic() - group.started)
+        # Only the share of the bytes that changed is downloaded again
+        changed = min(1, processed_written / processed) if processed else 1
+        return bytes_left * changed / rate
+
+    def get_eta(self):
+        """Seconds left in the run, None when unknown yet."""
+        with self.lock:
+            groups = list(self.groups.values())
+        etas = [self.get_group_eta(group) for group in groups]
+        return None if None in etas else max(etas, default=0)
+
+
+registry = TransferRegistry()
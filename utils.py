@@ -1,4 +1,4 @@
-import sys,os,shutil,logging
+import sys,os,logging
 from logging.handlers import RotatingFileHandler
 import threading
 from threading import Timer
@@ -51,13 +51,6 @@ def get_main_dir():
         return os.path.dirname(sys.argv[0]) # name of file
     return os.path.dirname(__file__)
     
-def has_enough_space(folder):
-    """Check if there is at least 1GB of free space."""
-    if os.path.isfile(folder) or os.path.isdir(folder):
-        total, used, free = shutil.disk_usage(folder)
-        return free >= config.MIN_FREE_SPACE_BYTES
-    return True
-    
 
 
 def remove_special_characters(character):
@@ -94,4 +87,12 @@ class RepeatedTimer:
     def stop(self):
         if self._timer:
             self._timer.cancel()
-            self.is_running = False
\ No newline at end of file
+            self.is_running = False
+def format_duration(seconds):
+    """Human readable duration, as 1h05m, 4m30s or 12s."""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"